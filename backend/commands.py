@@ -0,0 +1,197 @@
+import shlex
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from shell import SHELL_COMMANDS
+
+
+@dataclass
+class CommandContext:
+    sandbox_id: str
+    os_type: str
+    raw: str
+    name: str
+    args: List[str] = field(default_factory=list)
+    shell: Optional[object] = None
+    sandbox: Optional[dict] = None
+
+
+class Template:
+    """Response text with `{id}` placeholders split out once at registration."""
+
+    def __init__(self, text):
+        self.parts = text.split("{id}")
+
+    def __call__(self, ctx):
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return ctx.sandbox_id[:8].join(self.parts)
+
+
+class PrefixTrie:
+    """Character trie answering longest-registered-prefix queries."""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def longest_prefix(self, text):
+        node = self.root
+        found = node.get(None)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return found
+
+
+class CommandRegistry:
+    """Commands known to one OS template.
+
+    Exact commands are matched on the normalised command line, tools on the
+    longest registered prefix. Lookups that miss fall through to `parent`.
+    """
+
+    def __init__(self, parent=None, not_found_message=None):
+        self.parent = parent
+        self.not_found_message = not_found_message
+        self.exact = {}
+        self.tools = PrefixTrie()
+
+    def command(self, name, response):
+        self.exact[name] = response if callable(response) else Template(response)
+
+    def tool(self, prefix, response):
+        self.tools.insert(prefix, response if callable(response) else Template(response))
+
+    def resolve(self, key):
+        handler = self.exact.get(key)
+        if handler is None:
+            handler = self.tools.longest_prefix(key)
+        if handler is None and self.parent is not None:
+            return self.parent.resolve(key)
+        return handler
+
+    def not_found(self, ctx):
+        if self.not_found_message is not None:
+            return self.not_found_message.format(command=ctx.raw)
+        if self.parent is not None:
+            return self.parent.not_found(ctx)
+        return f"bash: {ctx.raw}: command not found"
+
+
+def parse_command(raw):
+    try:
+        tokens = shlex.split(raw)
+    except ValueError:
+        tokens = raw.split()
+    if not tokens:
+        return "", []
+    return tokens[0].lower(), tokens[1:]
+
+
+class CommandDispatcher:
+    def __init__(self):
+        self.base = CommandRegistry()
+        self.registries = {}
+
+    def registry(self, os_type):
+        """Registry for `os_type`, created on first use on top of the base one."""
+        if os_type not in self.registries:
+            self.registries[os_type] = CommandRegistry(parent=self.base)
+        return self.registries[os_type]
+
+    def dispatch(self, sandbox_id, os_type, raw, shell=None, sandbox=None):
+        raw = raw.strip()
+        name, args = parse_command(raw)
+        ctx = CommandContext(
+            sandbox_id=sandbox_id, os_type=os_type, raw=raw, name=name, args=args, shell=shell, sandbox=sandbox
+        )
+        registry = self.registries.get(os_type, self.base)
+        key = " ".join([name] + args)
+        handler = registry.resolve(key)
+        if handler is None:
+            return registry.not_found(ctx)
+        return handler(ctx)
+
+
+# Simulated command responses
+COMMAND_RESPONSES = {
+    "ls": "bin  boot  dev  etc  home  lib  media  mnt  opt  proc  root  run  sbin  srv  sys  tmp  usr  var",
+    "whoami": "root",
+    "pwd": "/root",
+    "uname -a": "Linux sandbox-{id} 5.15.0-kali3-amd64 #1 SMP Debian 5.15.15-2kali1 x86_64 GNU/Linux",
+    "ps aux": "USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND\nroot         1  0.0  0.1  19312  1604 ?        Ss   12:00   0:00 /sbin/init",
+    "ip a": "1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN\n    inet 127.0.0.1/8 scope host lo",
+    "df -h": "Filesystem      Size  Used Avail Use% Mounted on\n/dev/sda1        20G  2.1G   17G  12% /",
+    "free -h": "               total        used        free      shared  buff/cache   available\nMem:           4.0Gi       234Mi       3.4Gi        12Mi       356Mi       3.5Gi",
+    "netstat": "Active Internet connections (only servers)\nProto Recv-Q Send-Q Local Address           Foreign Address         State",
+    "help": "Available commands: ls, pwd, whoami, uname, ps, ip, df, free, netstat, nmap, metasploit, sqlmap, hashcat, john, aircrack-ng",
+    "msfconsole": "      =[ metasploit v6.2.23-dev                         ]\n+ -- --=[ 2230 exploits - 1177 auxiliary - 398 post       ]\n+ -- --=[ 867 payloads - 45 encoders - 11 nops            ]\nmsf6 > ",
+}
+
+# Simulated security tools, matched on their name as a prefix
+TOOL_RESPONSES = {
+    "nmap": "Starting Nmap scan...\nHosts discovered: 192.168.1.1, 192.168.1.100\nOpen ports: 22/tcp, 80/tcp, 443/tcp",
+    "metasploit": COMMAND_RESPONSES["msfconsole"],
+    "sqlmap": "sqlmap/1.6.12#stable\n[12:34:56] [INFO] testing connection to target URL\n[12:34:57] [INFO] target appears to be MySQL",
+    "hashcat": "hashcat (v6.2.5) starting...\nDevice #1: NVIDIA GeForce GTX 1080, 8192 MB",
+    "john": "John the Ripper 1.9.0-jumbo-1\nLoaded 1 password hash (md5crypt, crypt(3) $1$ [MD5 128/128 AVX 4x3])",
+    "aircrack-ng": "Aircrack-ng 1.6\nReading packets, please wait...\nOpening wpa.cap\nRead 12345 packets.",
+}
+
+WINDOWS_RESPONSES = {
+    "ver": "Microsoft Windows [Version 10.0.19045.3570]",
+    "whoami": "sandbox-{id}\\administrator",
+    "hostname": "sandbox-{id}",
+    "dir": " Volume in drive C has no label.\n Directory of C:\\Users\\Administrator\n\n10/17/2026  12:00 PM    <DIR>          Desktop\n10/17/2026  12:00 PM    <DIR>          Documents\n10/17/2026  12:00 PM    <DIR>          Downloads",
+    "ipconfig": "Windows IP Configuration\n\nEthernet adapter Ethernet0:\n   IPv4 Address. . . . . . . . . . . : 10.0.0.15\n   Subnet Mask . . . . . . . . . . . : 255.255.255.0",
+    "help": "Available commands: dir, ver, whoami, hostname, ipconfig, nmap, hashcat, john",
+}
+
+
+def echo(ctx):
+    return " ".join(ctx.args)
+
+
+def stateful(handler, fallback=None):
+    """Runs `handler` on the sandbox's shell, or `fallback` when there is none."""
+    def run(ctx):
+        if ctx.shell is None:
+            return fallback(ctx) if fallback is not None else f"bash: {ctx.name}: command not found"
+        return handler(ctx.shell, ctx)
+    return run
+
+
+def create_dispatcher(os_templates):
+    dispatcher = CommandDispatcher()
+    for name, response in COMMAND_RESPONSES.items():
+        dispatcher.base.command(name, response)
+    for prefix, response in TOOL_RESPONSES.items():
+        dispatcher.base.tool(prefix, response)
+    dispatcher.base.tool("echo", echo)
+
+    # Shell commands replace the static responses of the same name, e.g. "df -h"
+    for name, handler in SHELL_COMMANDS.items():
+        for key, static in list(dispatcher.base.exact.items()):
+            if key == name or key.startswith(name + " "):
+                dispatcher.base.exact[key] = stateful(handler, static)
+        if name not in dispatcher.base.exact:
+            dispatcher.base.command(name, stateful(handler))
+        dispatcher.base.tool(name + " ", stateful(handler))
+
+    for os_type in os_templates:
+        dispatcher.registry(os_type)
+
+    windows = dispatcher.registry("windows")
+    windows.not_found_message = "'{command}' is not recognized as an internal or external command,\noperable program or batch file."
+    for name, response in WINDOWS_RESPONSES.items():
+        windows.command(name, response)
+    return dispatcher
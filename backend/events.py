@@ -0,0 +1,105 @@
+import asyncio
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+
+class Subscription:
+    def __init__(self, max_queued):
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.overflowed = False
+
+
+class EventBus:
+    """In-process pub/sub of sandbox change events.
+
+    Every event gets a sequence number, which restarts with the process;
+    `epoch` tells processes apart. The last `buffer_size` events are kept
+    so a subscriber can resume after a reconnect; a subscriber that asks
+    for events older than the buffer or from another epoch, or falls more
+    than `max_queued` events behind, is told to reset and reload its state
+    instead.
+    Listeners are called synchronously with every event as it is published;
+    `internal` events only go to listeners, without a sequence number.
+    """
+
+    def __init__(self, buffer_size=1000, max_queued=1000):
+        self.seq = 0
+        self.epoch = uuid.uuid4().hex[:12]
+        self.max_queued = max_queued
+        self.buffer = deque(maxlen=buffer_size)
+        self.subscriptions = set()
+        self.listeners = []
+
+    def listen(self, callback):
+        self.listeners.append(callback)
+
+    def publish(self, event_type, sandbox_id, data=None, internal=False):
+        event = {
+            "seq": None,
+            "type": event_type,
+            "sandbox_id": sandbox_id,
+            "data": data or {},
+            "timestamp": datetime.now(timezone.utc),
+        }
+        if internal:
+            for listener in self.listeners:
+                listener(event)
+            return event
+        self.seq += 1
+        event["seq"] = self.seq
+        self.buffer.append(event)
+        for listener in self.listeners:
+            listener(event)
+        for subscription in self.subscriptions:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+        return event
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def parse_event_id(self, event_id):
+        """The sequence number in an `event_id`, or -1 if another process issued it."""
+        epoch, _, seq = event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return -1
+        return int(seq)
+
+    def subscribe(self, since=None):
+        """Returns the subscription and whether the client must reset first.
+
+        A negative `since`, or one ahead of the current sequence number, is
+        from before a restart.
+        """
+        subscription = Subscription(self.max_queued)
+        reset = False
+        if since is not None and (since < 0 or since > self.seq):
+            reset = True
+        elif since is not None and since < self.seq:
+            oldest = self.buffer[0]["seq"] if self.buffer else self.seq + 1
+            if since + 1 < oldest:
+                reset = True
+            else:
+                missed = [event for event in self.buffer if event["seq"] > since]
+                if len(missed) > self.max_queued:
+                    reset = True
+                else:
+                    for event in missed:
+                        subscription.queue.put_nowait(event)
+        self.subscriptions.add(subscription)
+        return subscription, reset
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def stats(self):
+        return {
+            "seq": self.seq,
+            "buffered": len(self.buffer),
+            "subscribers": len(self.subscriptions),
+        }
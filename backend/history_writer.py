@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from collections import Counter
+
+logger = logging.getLogger("trolixve.history")
+
+
+class HistoryWriter:
+    """Write-behind buffer for terminal history entries.
+
+    Entries are queued by `add` and written with `insert_many` once
+    `batch_size` entries are buffered or `flush_interval` seconds have
+    passed since the first one. The queue is bounded: when `max_pending`
+    entries are waiting, `add` blocks until the writer catches up.
+    """
+
+    def __init__(self, insert_many, batch_size=100, flush_interval=0.5, max_pending=10000):
+        self.insert_many = insert_many
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = Counter()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self._buffer = []
+        self._queue = None
+        self._lock = None
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._stopping = True
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def add(self, entry):
+        self.pending[entry["sandbox_id"]] += 1
+        await self._queue.put(entry)
+
+    def has_pending(self, sandbox_id):
+        return self.pending[sandbox_id] > 0
+
+    async def flush(self):
+        async with self._lock:
+            while not self._queue.empty():
+                self._buffer.append(self._queue.get_nowait())
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                await self._write(batch)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() + len(self._buffer) if self._queue else 0,
+            "max_pending": self.max_pending,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+    async def _write(self, batch):
+        try:
+            await self.insert_many(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Dropped %d history entries", len(batch))
+        finally:
+            for entry in batch:
+                self.pending[entry["sandbox_id"]] -= 1
+                if self.pending[entry["sandbox_id"]] <= 0:
+                    del self.pending[entry["sandbox_id"]]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # wait_for drops a cancellation that lands as an entry arrives, so
+        # the loop also checks whether the writer is stopping
+        while not self._stopping:
+            self._buffer.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._buffer) < self.batch_size and not self._stopping:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._buffer.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.flush()
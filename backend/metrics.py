@@ -0,0 +1,263 @@
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # per-bucket counts (last slot is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = format_labels(self.labels + ("le",), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from `callback` at render time; it returns {label values: value}."""
+
+    def __init__(self, name, help_text, callback, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        return self.register(Gauge(name, help_text, callback, labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records the count and duration of every Mongo command per collection.
+
+    pymongo calls these hooks from whichever thread runs the operation, so
+    the started events waiting for their reply are kept under a lock.
+    """
+
+    def __init__(self, registry):
+        self.commands = registry.histogram(
+            "trolixve_mongo_command_duration_seconds",
+            "Duration of MongoDB commands.",
+            labels=("collection", "command"),
+        )
+        self.failures = registry.counter(
+            "trolixve_mongo_command_failures_total",
+            "MongoDB commands that returned an error.",
+            labels=("collection", "command"),
+        )
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(event):
+        return event.request_id, event.connection_id
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        with self._lock:
+            self._collections[self._key(event)] = target if isinstance(target, str) else ""
+
+    def _finished(self, event):
+        with self._lock:
+            collection = self._collections.pop(self._key(event), "")
+        self.commands.observe(event.duration_micros / 1e6, collection, event.command_name)
+        return collection
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        collection = self._finished(event)
+        self.failures.inc(collection, event.command_name)
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections for each server's pool."""
+
+    def __init__(self, registry, max_pool_size):
+        self.max_pool_size = max_pool_size
+        self.open = {}
+        self.checked_out = {}
+        self.wait_failures = registry.counter(
+            "trolixve_mongo_pool_checkout_failures_total",
+            "Connection checkouts that failed or timed out waiting for the pool.",
+            labels=("address",),
+        )
+        registry.gauge(
+            "trolixve_mongo_pool_connections",
+            "Open connections per pool.",
+            lambda: self._labelled(self.open),
+            labels=("address",),
+        )
+        registry.gauge(
+            "trolixve_mongo_pool_checked_out",
+            "Connections currently checked out of each pool.",
+            lambda: self._labelled(self.checked_out),
+            labels=("address",),
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _address(event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _add(self, counts, event, amount):
+        address = self._address(event)
+        with self._lock:
+            counts[address] = max(0, counts.get(address, 0) + amount)
+
+    def _labelled(self, counts):
+        with self._lock:
+            return {(address,): count for address, count in counts.items()}
+
+    def stats(self):
+        with self._lock:
+            busiest = max(self.checked_out.values(), default=0)
+            return {
+                "max_pool_size": self.max_pool_size,
+                "open": dict(self.open),
+                "checked_out": dict(self.checked_out),
+                "saturation": round(busiest / self.max_pool_size, 4) if self.max_pool_size else 0.0,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        with self._lock:
+            self.open.pop(address, None)
+            self.checked_out.pop(address, None)
+
+    def connection_created(self, event):
+        self._add(self.open, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(self.open, event, -1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.wait_failures.inc(self._address(event))
+
+    def connection_checked_out(self, event):
+        self._add(self.checked_out, event, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, event, -1)
+
+
+class Timer:
+    """Context manager observing its elapsed time into a histogram."""
+
+    def __init__(self, histogram, *label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
@@ -0,0 +1,127 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ProvisioningQueue:
+    """Bounded pool of background workers that provisions sandboxes.
+
+    `provision` is a coroutine taking a sandbox id; it is awaited by one of
+    the workers for every submitted job. If given, `admit` is a coroutine
+    taking a sandbox id that waits until the sandbox may be provisioned and
+    returns False if it no longer should be; jobs wait for it in their own
+    task, "waiting", so they never hold a worker. Job records are kept in
+    memory and the oldest finished ones are dropped once `max_history` is
+    reached.
+    """
+
+    def __init__(self, provision, workers=4, max_pending=1000, max_history=5000, admit=None):
+        self.provision = provision
+        self.admit = admit
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        self._admitting = set()
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        tasks = self._tasks + list(self._admitting)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._admitting.clear()
+
+    def submit(self, sandbox_id):
+        if self._queue is None:
+            raise RuntimeError("Provisioning queue is not started")
+        if self._queue.qsize() + len(self._admitting) >= self.max_pending:
+            raise QueueFullError("Provisioning queue is full")
+        job = {
+            "id": str(uuid.uuid4()),
+            "sandbox_id": sandbox_id,
+            "status": "queued" if self.admit is None else "waiting",
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        if self.admit is None:
+            self._queue.put_nowait(job["id"])
+        else:
+            task = asyncio.create_task(self._admit(job))
+            self._admitting.add(task)
+            task.add_done_callback(self._admitting.discard)
+        self.jobs[job["id"]] = job
+        self._trim_history()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        counts = {"waiting": 0, "queued": 0, "running": 0, "completed": 0, "failed": 0}
+        for job in self.jobs.values():
+            counts[job["status"]] += 1
+        return {
+            "workers": self.workers,
+            "pending": (self._queue.qsize() if self._queue else 0) + len(self._admitting),
+            "max_pending": self.max_pending,
+            "jobs": counts,
+        }
+
+    def _trim_history(self):
+        if len(self.jobs) <= self.max_history:
+            return
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_history:
+                break
+            if self.jobs[job_id]["status"] in ("completed", "failed"):
+                del self.jobs[job_id]
+
+    async def _admit(self, job):
+        try:
+            admitted = await self.admit(job["sandbox_id"])
+        except Exception as exc:
+            job["status"] = "failed"
+            job["error"] = str(exc)
+            admitted = None
+        if not admitted:
+            if admitted is not None:
+                job["status"] = "completed"
+            job["finished_at"] = datetime.now().isoformat()
+            return
+        job["status"] = "queued"
+        await self._queue.put(job["id"])
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            try:
+                if job is None:
+                    continue
+                job["status"] = "running"
+                job["started_at"] = datetime.now().isoformat()
+                try:
+                    await self.provision(job["sandbox_id"])
+                    job["status"] = "completed"
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    job["status"] = "failed"
+                    job["error"] = str(exc)
+                job["finished_at"] = datetime.now().isoformat()
+            finally:
+                self._queue.task_done()
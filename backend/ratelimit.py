@@ -0,0 +1,192 @@
+import logging
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("trolixve.ratelimit")
+
+
+class RateLimited(Exception):
+    def __init__(self, limit, reason, retry_after):
+        super().__init__(f"Too many requests ({limit} {reason}), retry in {retry_after:.2f}s")
+        self.limit = limit
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Limit:
+    """How fast and how concurrently one client may use a group of routes.
+
+    `rate` tokens per second refill a bucket of `burst` tokens per client;
+    `client_concurrency` and `sandbox_concurrency` cap the requests in
+    flight per client and per sandbox. A value of 0 disables that check.
+    """
+
+    __slots__ = ("name", "rate", "burst", "client_concurrency", "sandbox_concurrency")
+
+    def __init__(self, name, rate, burst, client_concurrency=0, sandbox_concurrency=0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.client_concurrency = client_concurrency
+        self.sandbox_concurrency = sandbox_concurrency
+
+
+class TokenBuckets:
+    """Token buckets in process memory, for a single API process.
+
+    Only the `max_keys` most recently used buckets are kept; a bucket
+    dropped after a while unused would have refilled anyway.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst, cost=1):
+        """Takes `cost` tokens; returns 0, or the seconds until they are available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {"backend": "memory", "buckets": len(self._buckets), "max_keys": self.max_keys}
+
+
+class RateLimiter:
+    """Token-bucket rate limits and concurrency caps per client and sandbox.
+
+    `routes` is a list of (method, path regex, Limit); a named `sandbox_id`
+    group in the regex identifies the sandbox a request acts on. `buckets`
+    is a TokenBuckets or anything with the same `take` coroutine, e.g. a
+    RateLimitRepository shared by several API processes; if it fails the
+    request is let through. Concurrency is counted in this process.
+    Clients are keyed on the first X-Forwarded-For address when
+    `trust_proxy` is set, else on the connection's address; a warning is
+    logged once if forwarded requests arrive while it is not set.
+    """
+
+    def __init__(self, buckets, routes, trust_proxy=False):
+        self.buckets = buckets
+        self.routes = [(method, re.compile(pattern), limit) for method, pattern, limit in routes]
+        self.trust_proxy = trust_proxy
+        self.in_flight = Counter()
+        self.allowed = Counter()
+        self.limited = Counter()
+        self.backend_errors = 0
+        self.warned_proxy = False
+
+    def match(self, method, path):
+        """The Limit for a request and the sandbox id in its path, if any."""
+        for route_method, pattern, limit in self.routes:
+            if route_method == method:
+                match = pattern.fullmatch(path)
+                if match:
+                    return limit, match.groupdict().get("sandbox_id")
+        return None, None
+
+    def client_of(self, connection):
+        """The client address of a request or websocket."""
+        forwarded = connection.headers.get("x-forwarded-for")
+        if forwarded and self.trust_proxy:
+            return forwarded.split(",")[0].strip()
+        if forwarded and not self.warned_proxy:
+            self.warned_proxy = True
+            logger.warning(
+                "Requests arrive through a proxy but RATE_LIMIT_TRUST_PROXY is off; "
+                "every client behind it shares the proxy's limits"
+            )
+        return connection.client.host if connection.client else "unknown"
+
+    def _refuse(self, limit, reason, retry_after):
+        self.limited[limit.name, reason] += 1
+        raise RateLimited(limit.name, reason, retry_after)
+
+    async def acquire(self, limit, client, sandbox_id=None):
+        """Takes a slot and a token for a request; raises RateLimited if refused.
+
+        Returns the keys to pass to `release` once the request is done.
+        """
+        caps = []
+        if limit.client_concurrency:
+            caps.append((f"client:{client}", limit.client_concurrency))
+        if limit.sandbox_concurrency and sandbox_id:
+            caps.append((f"sandbox:{sandbox_id}", limit.sandbox_concurrency))
+        # Slots are taken before awaiting the buckets, so requests checked
+        # meanwhile count this one
+        held = []
+        try:
+            for key, cap in caps:
+                slot = (limit.name, key)
+                if self.in_flight[slot] >= cap:
+                    self._refuse(limit, "concurrency", 1.0)
+                self.in_flight[slot] += 1
+                held.append(slot)
+            if limit.rate:
+                try:
+                    wait = await self.buckets.take(f"{limit.name}:{client}", limit.rate, limit.burst)
+                except Exception:
+                    self.backend_errors += 1
+                    logger.exception("Rate limit backend failed, letting the request through")
+                    wait = 0.0
+                if wait:
+                    self._refuse(limit, "rate", wait)
+        except BaseException:
+            self.release(held)
+            raise
+        self.allowed[limit.name] += 1
+        return held
+
+    def release(self, held):
+        for slot in held:
+            self.in_flight[slot] -= 1
+            if self.in_flight[slot] <= 0:
+                del self.in_flight[slot]
+
+    @asynccontextmanager
+    async def hold(self, limit, client, sandbox_id=None):
+        held = await self.acquire(limit, client, sandbox_id)
+        try:
+            yield
+        finally:
+            self.release(held)
+
+    def stats(self):
+        limits = {}
+        for _, pattern, limit in self.routes:
+            if limit.name in limits:
+                limits[limit.name]["routes"].append(pattern.pattern)
+                continue
+            limits[limit.name] = {
+                "rate": limit.rate,
+                "burst": limit.burst,
+                "client_concurrency": limit.client_concurrency,
+                "sandbox_concurrency": limit.sandbox_concurrency,
+                "routes": [pattern.pattern],
+                "allowed": self.allowed[limit.name],
+                "limited": {
+                    reason: self.limited[limit.name, reason] for reason in ("rate", "concurrency")
+                },
+                "in_flight": sum(count for (name, _), count in self.in_flight.items() if name == limit.name),
+            }
+        return {
+            "buckets": self.buckets.stats(),
+            "trust_proxy": self.trust_proxy,
+            "backend_errors": self.backend_errors,
+            "limits": limits,
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("trolixve.reaper")
+
+IDLE_STATUSES = {"save": "saved", "stop": "stopped"}
+
+
+class IdleReaper:
+    """Background accounting of sandbox activity and uptime.
+
+    Terminal activity is recorded in memory by `touch` and written to
+    `last_accessed` once per sweep. Every `interval` seconds the uptime of
+    running sandboxes is brought up to date, `batch_size` sandboxes at a
+    time, and sandboxes idle for longer than `idle_after` seconds are moved
+    to the status of `action` ("save" or "stop"); with "save", `on_save`
+    is awaited with their ids first. An `idle_after` of 0 disables reaping
+    but keeps the accounting.
+    """
+
+    def __init__(self, repository, idle_after=1800, action="save", interval=60, batch_size=500, on_save=None):
+        if action not in IDLE_STATUSES:
+            raise ValueError(f"Unknown idle action: {action}")
+        self.repository = repository
+        self.idle_after = idle_after
+        self.action = action
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_save = on_save
+        self.sweeps = 0
+        self.reaped = 0
+        self.failed_sweeps = 0
+        self.last_sweep = None
+        self._last_seen = {}
+        self._lock = None
+        self._task = None
+
+    def start(self):
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_activity()
+
+    def touch(self, sandbox_id):
+        self._last_seen[sandbox_id] = datetime.now(timezone.utc)
+
+    async def flush_activity(self):
+        last_seen, self._last_seen = self._last_seen, {}
+        try:
+            await self.repository.touch_many(last_seen)
+        except Exception:
+            # Keep the times so the next sweep retries them, unless newer ones arrived
+            for sandbox_id, seen in last_seen.items():
+                self._last_seen.setdefault(sandbox_id, seen)
+            raise
+
+    async def account(self, sandbox_ids):
+        """Brings the uptime of running sandboxes up to date, e.g. before they stop."""
+        await self.repository.account_uptime(sandbox_ids, datetime.now(timezone.utc))
+
+    async def sweep(self):
+        async with self._lock:
+            await self.flush_activity()
+            now = datetime.now(timezone.utc)
+            async for batch in self.repository.running_ids(self.batch_size):
+                await self.repository.account_uptime(batch, now)
+            if self.idle_after:
+                cutoff = now - timedelta(seconds=self.idle_after)
+                while True:
+                    idle = await self.repository.idle(cutoff, self.batch_size)
+                    if not idle:
+                        break
+                    if self.action == "save" and self.on_save is not None:
+                        await self.on_save(list(idle))
+                    await self.repository.update_many(idle, {"status": IDLE_STATUSES[self.action]})
+                    self.reaped += len(idle)
+                    logger.info("Moved %d idle sandboxes to %s", len(idle), IDLE_STATUSES[self.action])
+            self.sweeps += 1
+            self.last_sweep = datetime.now(timezone.utc)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "idle_after": self.idle_after,
+            "action": self.action,
+            "batch_size": self.batch_size,
+            "pending_activity": len(self._last_seen),
+            "sweeps": self.sweeps,
+            "failed_sweeps": self.failed_sweeps,
+            "reaped": self.reaped,
+            "last_sweep": self.last_sweep,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_sweeps += 1
+                logger.exception("Idle sandbox sweep failed")
@@ -0,0 +1,699 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import TTLCache
+
+
+def mongo_client_options():
+    """Connection pool settings, tunable through the environment."""
+    return {
+        "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '60000')),
+        "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '20000')),
+        "tz_aware": True,
+    }
+
+
+def create_client(mongo_url, event_listeners=()):
+    return AsyncIOMotorClient(mongo_url, event_listeners=list(event_listeners), **mongo_client_options())
+
+
+def serialize(doc):
+    if doc is not None and "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return doc
+
+
+def as_utc(timestamp):
+    """`timestamp` made timezone-aware; naive ones from the database are UTC."""
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(timestamp, tie_breaker):
+    raw = json.dumps([timestamp.isoformat(), str(tie_breaker)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (timestamp, tie breaker) pair stored in an opaque cursor."""
+    try:
+        timestamp, tie_breaker = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), tie_breaker
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+class SandboxRepository:
+    """Async access to the sandboxes collection.
+
+    Single-sandbox reads go through `cache` when one is given; every write
+    made through the repository updates or invalidates the cached record
+    and is published to `events`. Writes to warm-pool sandboxes (those with
+    `pool` set) are published as internal events until they are handed out.
+    """
+
+    def __init__(self, collection, cache=None, events=None):
+        self.collection = collection
+        self.cache = cache
+        self.events = events
+
+    def _publish(self, event_type, sandbox_id, data, internal=False):
+        if self.events is not None:
+            self.events.publish(event_type, sandbox_id, data, internal=internal)
+
+    def _cache_set(self, sandbox):
+        if self.cache is not None:
+            self.cache.set(sandbox["id"], dict(sandbox))
+
+    async def page(self, filters=None, limit=100, cursor=None, fields=None):
+        """Keyset page ordered by (created_at, id).
+
+        Returns the documents and the cursor of the next page, or None when
+        this was the last one.
+        """
+        query = dict(filters or {})
+        if cursor:
+            created_at, sandbox_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "id": {"$gt": sandbox_id}},
+            ]
+        projection = None
+        if fields:
+            projection = {field: 1 for field in fields}
+            projection.update({"id": 1, "created_at": 1})
+        find = self.collection.find(query, projection)
+        find = find.sort([("created_at", 1), ("id", 1)]).limit(limit + 1)
+        docs = [serialize(doc) async for doc in find]
+        next_cursor = None
+        if len(docs) > limit:
+            next_cursor = encode_cursor(docs[limit - 1]["created_at"], docs[limit - 1]["id"])
+        return docs[:limit], next_cursor
+
+    async def count_by_status(self, filters=None):
+        pipeline = [
+            {"$match": dict(filters or {})},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]
+        return {doc["_id"]: doc["count"] async for doc in self.collection.aggregate(pipeline)}
+
+    async def get(self, sandbox_id):
+        if self.cache is not None:
+            cached = self.cache.get(sandbox_id)
+            if cached is not None:
+                return dict(cached)
+        sandbox = serialize(await self.collection.find_one({"id": sandbox_id}))
+        if sandbox is not None:
+            self._cache_set(sandbox)
+        return sandbox
+
+    async def insert(self, sandbox):
+        await self.collection.insert_one(sandbox)
+        self._cache_set(serialize(sandbox))
+        self._publish("sandbox.created", sandbox["id"], sandbox, internal=sandbox.get("pool", False))
+        return sandbox
+
+    async def insert_many(self, sandboxes):
+        if sandboxes:
+            await self.collection.insert_many(sandboxes)
+        for sandbox in sandboxes:
+            self._cache_set(serialize(sandbox))
+            self._publish("sandbox.created", sandbox["id"], sandbox, internal=sandbox.get("pool", False))
+        return sandboxes
+
+    async def update(self, sandbox_id, fields, expected_status=None):
+        """Set `fields` on a sandbox; returns False when no sandbox matched."""
+        query = {"id": sandbox_id}
+        if expected_status is not None:
+            query["status"] = expected_status
+        previous = await self.collection.find_one_and_update(
+            query,
+            {"$set": fields},
+            projection={"_id": 0, "status": 1, "pool": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is None:
+            if self.cache is not None:
+                self.cache.invalidate(sandbox_id)
+            return False
+        self._updated(sandbox_id, fields, previous.get("status"), internal=previous.get("pool", False))
+        return True
+
+    def _updated(self, sandbox_id, fields, previous_status, internal=False):
+        if self.cache is not None:
+            cached = self.cache.peek(sandbox_id)
+            if cached is not None:
+                self._cache_set({**cached, **fields})
+        self._publish("sandbox.updated", sandbox_id, {
+            "changes": fields,
+            "previous_status": previous_status,
+        }, internal=internal)
+
+    async def statuses(self, query):
+        """Maps the id of every sandbox matching `query` to its status."""
+        find = self.collection.find(query, {"_id": 0, "id": 1, "status": 1})
+        return {doc["id"]: doc.get("status") async for doc in find}
+
+    async def resources(self, query=None):
+        """Status and resource sizes of every sandbox matching `query`."""
+        find = self.collection.find(query or {}, {
+            "_id": 0, "id": 1, "status": 1, "cpu_cores": 1, "ram_gb": 1, "disk_gb": 1,
+        })
+        return [doc async for doc in find]
+
+    async def update_many(self, previous, fields):
+        """Set `fields` on the sandboxes of `previous`, a {id: status} map."""
+        if not previous:
+            return 0
+        result = await self.collection.update_many({"id": {"$in": list(previous)}}, {"$set": fields})
+        for sandbox_id, status in previous.items():
+            self._updated(sandbox_id, fields, status)
+        return result.matched_count
+
+    async def pooled_counts(self):
+        """Warm-pool sandboxes being provisioned or ready, per os_type."""
+        pipeline = [
+            {"$match": {"pool": True, "status": {"$in": ["creating", "warm"]}}},
+            {"$group": {"_id": "$os_type", "count": {"$sum": 1}}},
+        ]
+        return {doc["_id"]: doc["count"] async for doc in self.collection.aggregate(pipeline)}
+
+    async def claim_pooled(self, os_type, fields):
+        """Takes the oldest warm sandbox of `os_type` out of the pool with `fields` set.
+
+        Returns None when none is ready. Nothing is published until the
+        caller `announce`s the sandbox or puts it back with `return_to_pool`.
+        """
+        sandbox = await self.collection.find_one_and_update(
+            {"pool": True, "os_type": os_type, "status": "warm"},
+            {"$set": fields, "$unset": {"pool": ""}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if sandbox is None:
+            return None
+        sandbox = serialize(sandbox)
+        self._cache_set(sandbox)
+        return sandbox
+
+    def announce(self, sandbox):
+        self._publish("sandbox.created", sandbox["id"], sandbox)
+
+    async def return_to_pool(self, sandbox_id):
+        if self.cache is not None:
+            self.cache.invalidate(sandbox_id)
+        await self.collection.update_one({"id": sandbox_id}, {"$set": {"pool": True, "status": "warm"}})
+
+    def running_ids(self, batch_size=500):
+        """Yields the ids of running sandboxes in batches, in id order."""
+        return self.ids_with_status("running", batch_size)
+
+    async def ids_with_status(self, status, batch_size=500):
+        """Yields the ids of sandboxes in `status` in batches, in id order."""
+        last_id = None
+        while True:
+            query = {"status": status}
+            if last_id is not None:
+                query["id"] = {"$gt": last_id}
+            find = self.collection.find(query, {"_id": 0, "id": 1}).sort("id", 1).limit(batch_size)
+            batch = [doc["id"] async for doc in find]
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
+
+    async def account_uptime(self, sandbox_ids, now):
+        """Adds the whole seconds run from `uptime_updated_at` to `now` to `uptime`."""
+        if not sandbox_ids:
+            return 0
+        find = self.collection.find(
+            {"id": {"$in": list(sandbox_ids)}, "status": "running"},
+            {"_id": 0, "id": 1, "uptime_updated_at": 1, "last_accessed": 1},
+        )
+        updates = []
+        async for doc in find:
+            updated = doc.get("uptime_updated_at")
+            since = updated or doc.get("last_accessed")
+            if since is None:
+                continue
+            elapsed = int((now - as_utc(since)).total_seconds())
+            if elapsed <= 0:
+                continue
+            # Only count from `since` once, if another pass got there first;
+            # the fraction of a second is carried over to the next pass
+            updates.append(UpdateOne(
+                {"id": doc["id"], "status": "running", "uptime_updated_at": updated},
+                {"$inc": {"uptime": elapsed}, "$set": {"uptime_updated_at": as_utc(since) + timedelta(seconds=elapsed)}},
+            ))
+        if not updates:
+            return 0
+        result = await self.collection.bulk_write(updates, ordered=False)
+        if self.cache is not None:
+            for sandbox_id in sandbox_ids:
+                self.cache.invalidate(sandbox_id)
+        return result.modified_count
+
+    async def touch_many(self, last_seen):
+        """Moves `last_accessed` forward to the times in a {id: datetime} map."""
+        if not last_seen:
+            return 0
+        result = await self.collection.bulk_write(
+            [UpdateOne({"id": sandbox_id}, {"$max": {"last_accessed": seen}}) for sandbox_id, seen in last_seen.items()],
+            ordered=False,
+        )
+        if self.cache is not None:
+            for sandbox_id, seen in last_seen.items():
+                cached = self.cache.peek(sandbox_id)
+                if cached is not None and cached["last_accessed"] < seen:
+                    self._cache_set({**cached, "last_accessed": seen})
+        return result.modified_count
+
+    async def idle(self, cutoff, limit=500):
+        """{id: status} of running sandboxes not accessed since `cutoff`."""
+        find = self.collection.find(
+            {"status": "running", "last_accessed": {"$lt": cutoff}},
+            {"_id": 0, "id": 1, "status": 1},
+        ).limit(limit)
+        return {doc["id"]: doc["status"] async for doc in find}
+
+    async def delete(self, sandbox_id):
+        if self.cache is not None:
+            self.cache.invalidate(sandbox_id)
+        previous = await self.collection.find_one_and_delete(
+            {"id": sandbox_id}, projection={"_id": 0, "status": 1, "pool": 1}
+        )
+        if previous is None:
+            return False
+        self._publish(
+            "sandbox.deleted", sandbox_id, {"previous_status": previous.get("status")}, internal=previous.get("pool", False)
+        )
+        return True
+
+    async def delete_many(self, previous):
+        """Delete the sandboxes of `previous`, a {id: status} map."""
+        if not previous:
+            return 0
+        for sandbox_id in previous:
+            if self.cache is not None:
+                self.cache.invalidate(sandbox_id)
+        result = await self.collection.delete_many({"id": {"$in": list(previous)}})
+        for sandbox_id, status in previous.items():
+            self._publish("sandbox.deleted", sandbox_id, {"previous_status": status})
+        return result.deleted_count
+
+
+def output_digest(output):
+    return hashlib.sha256(output.encode()).hexdigest()
+
+
+def encode_output(output, compress_min_bytes):
+    """Stored form of an output blob: zlib-compressed once it is large enough."""
+    raw = output.encode()
+    if compress_min_bytes and len(raw) >= compress_min_bytes:
+        return {"data": Binary(zlib.compress(raw)), "encoding": "zlib", "size": len(raw)}
+    return {"data": output, "encoding": None, "size": len(raw)}
+
+
+def decode_output(blob):
+    if blob.get("encoding") == "zlib":
+        return zlib.decompress(blob["data"]).decode()
+    return blob["data"]
+
+
+class SessionRepository:
+    """Async access to the terminal sessions collection.
+
+    When an `outputs` collection is given, outputs of at least
+    `dedup_min_bytes` are stored once there, keyed by their SHA-256, and
+    history entries keep an `output_ref` to them; blobs of at least
+    `compress_min_bytes` are zlib-compressed. Reads put the output back, so
+    callers always see an `output` field. Writes and output garbage
+    collection are serialised so a blob is never removed while an entry
+    referencing it is being written.
+    """
+
+    def __init__(self, collection, outputs=None, dedup_min_bytes=64, compress_min_bytes=4096, blob_cache_size=1000):
+        self.collection = collection
+        self.outputs = outputs
+        self.dedup_min_bytes = dedup_min_bytes
+        self.compress_min_bytes = compress_min_bytes
+        # Decoded outputs by digest; a hit also means the blob is stored
+        self.blobs = TTLCache(maxsize=blob_cache_size, ttl=3600)
+        self._outputs_lock = asyncio.Lock()
+
+    def _deduplicate(self, entries):
+        """Entries with large outputs swapped for references, and the new blobs."""
+        stored, blobs = [], {}
+        for entry in entries:
+            output = entry.get("output")
+            if not isinstance(output, str) or len(output.encode()) < self.dedup_min_bytes:
+                stored.append(entry)
+                continue
+            digest = output_digest(output)
+            if self.blobs.peek(digest) is None:
+                blobs[digest] = output
+            entry = {key: value for key, value in entry.items() if key != "output"}
+            entry["output_ref"] = digest
+            stored.append(entry)
+        return stored, blobs
+
+    async def _store_blobs(self, blobs):
+        if not blobs:
+            return
+        try:
+            await self.outputs.bulk_write(
+                [
+                    UpdateOne({"_id": digest}, {"$setOnInsert": encode_output(output, self.compress_min_bytes)}, upsert=True)
+                    for digest, output in blobs.items()
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as exc:
+            # Concurrent upserts of the same digest race on _id; the blob exists either way
+            if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+                raise
+        for digest, output in blobs.items():
+            self.blobs.set(digest, output)
+
+    async def add_many(self, entries):
+        if self.outputs is None:
+            await self.collection.insert_many(entries, ordered=False)
+            return
+        async with self._outputs_lock:
+            entries, blobs = self._deduplicate(entries)
+            await self._store_blobs(blobs)
+            await self.collection.insert_many(entries, ordered=False)
+
+    async def _resolve(self, docs):
+        refs = {doc["output_ref"] for doc in docs if "output_ref" in doc}
+        if not refs:
+            return docs
+        outputs = {}
+        for digest in refs:
+            output = self.blobs.get(digest)
+            if output is not None:
+                outputs[digest] = output
+        missing = list(refs - outputs.keys())
+        if missing:
+            async for blob in self.outputs.find({"_id": {"$in": missing}}):
+                outputs[blob["_id"]] = decode_output(blob)
+                self.blobs.set(blob["_id"], outputs[blob["_id"]])
+        for doc in docs:
+            digest = doc.pop("output_ref", None)
+            if digest is not None:
+                doc["output"] = outputs.get(digest, "")
+        return docs
+
+    @staticmethod
+    def cursor_for(entry):
+        return encode_cursor(entry["timestamp"], entry["_id"])
+
+    @staticmethod
+    def _after(cursor, op):
+        timestamp, entry_id = decode_cursor(cursor)
+        try:
+            entry_id = ObjectId(entry_id)
+        except InvalidId:
+            raise ValueError("Invalid cursor")
+        return [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: entry_id}},
+        ]
+
+    async def page(self, sandbox_id, limit=100, since=None, before=None, newest=False):
+        """One page of history in chronological order.
+
+        Pages are read forward from the start (or from `since`), unless
+        `before` or `newest` is given, in which case the newest entries
+        (older than `before`) are returned. The second value tells whether
+        more entries exist past the page in the direction read.
+        """
+        query = {"sandbox_id": sandbox_id}
+        direction = 1
+        if since:
+            query["$or"] = self._after(since, "$gt")
+        elif before:
+            query["$or"] = self._after(before, "$lt")
+            direction = -1
+        elif newest:
+            direction = -1
+        find = self.collection.find(query).sort([("timestamp", direction), ("_id", direction)])
+        docs = [serialize(doc) async for doc in find.limit(limit + 1)]
+        has_more = len(docs) > limit
+        docs = await self._resolve(docs[:limit])
+        if direction == -1:
+            docs.reverse()
+        return docs, has_more
+
+    async def delete_after(self, sandbox_id, cursor=None):
+        """Deletes a sandbox's entries newer than `cursor` (all of them without one)."""
+        query = {"sandbox_id": sandbox_id}
+        if cursor:
+            query["$or"] = self._after(cursor, "$gt")
+        result = await self.collection.delete_many(query)
+        return result.deleted_count
+
+    async def delete_for(self, sandbox_ids):
+        result = await self.collection.delete_many({"sandbox_id": {"$in": list(sandbox_ids)}})
+        return result.deleted_count
+
+    async def stream(self, sandbox_id, batch_size=500):
+        find = self.collection.find({"sandbox_id": sandbox_id}).sort([("timestamp", 1), ("_id", 1)])
+        batch = []
+        async for doc in find.batch_size(batch_size):
+            batch.append(serialize(doc))
+            if len(batch) >= batch_size:
+                for entry in await self._resolve(batch):
+                    yield entry
+                batch = []
+        for entry in await self._resolve(batch):
+            yield entry
+
+    async def trim(self, max_entries):
+        """Deletes the oldest entries of every sandbox holding more than `max_entries`."""
+        over = self.collection.aggregate([
+            {"$group": {"_id": "$sandbox_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": max_entries}}},
+        ], allowDiskUse=True)
+        deletes = []
+        async for group in over:
+            sandbox_id = group["_id"]
+            # Newest entry that falls outside the retained window
+            boundary = await self.collection.find_one(
+                {"sandbox_id": sandbox_id},
+                {"timestamp": 1},
+                sort=[("timestamp", -1), ("_id", -1)],
+                skip=max_entries,
+            )
+            if boundary is None:
+                continue
+            deletes.append(DeleteMany({
+                "sandbox_id": sandbox_id,
+                "$or": [
+                    {"timestamp": {"$lt": boundary["timestamp"]}},
+                    {"timestamp": boundary["timestamp"], "_id": {"$lte": boundary["_id"]}},
+                ],
+            }))
+        if not deletes:
+            return 0
+        result = await self.collection.bulk_write(deletes, ordered=False)
+        return result.deleted_count
+
+    async def compact_outputs(self, batch_size=500):
+        """Moves large outputs still stored inline into deduplicated blobs."""
+        if self.outputs is None:
+            return 0
+        query = {
+            "output": {"$type": "string"},
+            "$expr": {"$gte": [{"$strLenBytes": "$output"}, self.dedup_min_bytes]},
+        }
+        moved = 0
+        while True:
+            async with self._outputs_lock:
+                docs = await self.collection.find(query, {"output": 1}).limit(batch_size).to_list(None)
+                if not docs:
+                    return moved
+                blobs = {}
+                updates = []
+                for doc in docs:
+                    digest = output_digest(doc["output"])
+                    if self.blobs.peek(digest) is None:
+                        blobs[digest] = doc["output"]
+                    updates.append(UpdateOne(
+                        {"_id": doc["_id"]},
+                        {"$set": {"output_ref": digest}, "$unset": {"output": ""}},
+                    ))
+                await self._store_blobs(blobs)
+                await self.collection.bulk_write(updates, ordered=False)
+                moved += len(updates)
+
+    async def collect_outputs(self):
+        """Deletes output blobs no history entry refers to any more."""
+        if self.outputs is None:
+            return 0
+        async with self._outputs_lock:
+            referenced = set()
+            refs = self.collection.aggregate([
+                {"$match": {"output_ref": {"$exists": True}}},
+                {"$group": {"_id": "$output_ref"}},
+            ], allowDiskUse=True)
+            async for ref in refs:
+                referenced.add(ref["_id"])
+            unreferenced = [
+                blob["_id"] async for blob in self.outputs.find({}, {"_id": 1})
+                if blob["_id"] not in referenced
+            ]
+            deleted = 0
+            for start in range(0, len(unreferenced), 1000):
+                result = await self.outputs.delete_many({"_id": {"$in": unreferenced[start:start + 1000]}})
+                deleted += result.deleted_count
+            if deleted:
+                self.blobs.clear()
+            return deleted
+
+
+class SnapshotRepository:
+    """Async access to the snapshots collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, snapshot):
+        await self.collection.insert_one(snapshot)
+        return serialize(snapshot)
+
+    async def get(self, snapshot_id):
+        return serialize(await self.collection.find_one({"id": snapshot_id}))
+
+    async def list_for(self, sandbox_id):
+        find = self.collection.find({"sandbox_id": sandbox_id}, {"_id": 0, "entries": 0}).sort("created_at", -1)
+        return [doc async for doc in find]
+
+    async def count(self):
+        return await self.collection.count_documents({})
+
+    async def record_restore(self, snapshot_id, restore_ms):
+        await self.collection.update_one({"id": snapshot_id}, {"$set": {"restore_ms": restore_ms}})
+
+    async def delete(self, snapshot_id):
+        result = await self.collection.delete_one({"id": snapshot_id})
+        return result.deleted_count > 0
+
+    async def live_chunks(self):
+        """Digests of every chunk some snapshot still refers to."""
+        live = set()
+        async for doc in self.collection.find({}, {"_id": 0, "entries": 1}):
+            for entry in doc["entries"]:
+                live.update(entry["chunks"] or ())
+        return live
+
+
+class ShellRepository:
+    """Async access to per-sandbox shell state.
+
+    `states` holds one document per sandbox with its cwd and environment
+    overrides (null for an unset variable); `files` holds one document per
+    path the sandbox changed in its image: a file with its content, a
+    directory created empty, or a whiteout for a deleted path.
+    """
+
+    def __init__(self, states, files):
+        self.states = states
+        self.files = files
+
+    async def load(self, sandbox_id):
+        stored = await self.states.find_one({"sandbox_id": sandbox_id}, {"_id": 0})
+        files = await self.files.find({"sandbox_id": sandbox_id}, {"_id": 0, "sandbox_id": 0}).to_list(None)
+        return stored, files
+
+    async def save(self, sandbox_id, changes):
+        """Writes queued (kind, path or name, value) changes in order."""
+        operations = []
+        state = {}
+        for kind, path, value in changes:
+            selector = {"sandbox_id": sandbox_id, "path": path}
+            if kind == "file":
+                operations.append(UpdateOne(selector, {"$set": {"kind": "file", "content": value}}, upsert=True))
+            elif kind == "dir":
+                operations.append(UpdateOne(selector, {"$set": {"kind": "dir"}, "$unset": {"content": ""}}, upsert=True))
+            elif kind == "delete":
+                operations.append(DeleteMany({"sandbox_id": sandbox_id, "path": {"$regex": f"^{re.escape(path)}/"}}))
+                operations.append(UpdateOne(selector, {"$set": {"kind": "deleted"}, "$unset": {"content": ""}}, upsert=True))
+            elif kind == "cwd":
+                state["cwd"] = path
+            elif kind == "env":
+                state[f"env.{path}"] = value
+        if operations:
+            await self.files.bulk_write(operations, ordered=True)
+        if state:
+            await self.states.update_one({"sandbox_id": sandbox_id}, {"$set": state}, upsert=True)
+
+    async def set_environment(self, sandbox_id, cwd, env):
+        await self.states.update_one(
+            {"sandbox_id": sandbox_id}, {"$set": {"cwd": cwd, "env": env}}, upsert=True
+        )
+
+    async def replace_files(self, sandbox_id, files):
+        await self.files.delete_many({"sandbox_id": sandbox_id})
+        if files:
+            await self.files.insert_many([{"sandbox_id": sandbox_id, **change} for change in files], ordered=False)
+
+    async def delete_for(self, sandbox_ids):
+        await self.states.delete_many({"sandbox_id": {"$in": list(sandbox_ids)}})
+        await self.files.delete_many({"sandbox_id": {"$in": list(sandbox_ids)}})
+
+
+class RateLimitRepository:
+    """Token buckets kept in Mongo, shared by every API process.
+
+    Each bucket is refilled and drawn from in a single pipeline update
+    timed by the server clock, so concurrent processes never race on it.
+    A bucket expires once it would have refilled completely.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key, rate, burst, cost=1):
+        """Takes `cost` tokens; returns 0, or the seconds until they are available."""
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"_refilled": refilled, "updated_at": "$$NOW"}},
+                {"$set": {
+                    "allowed": {"$gte": ["$_refilled", cost]},
+                    "tokens": {"$cond": [
+                        {"$gte": ["$_refilled", cost]}, {"$subtract": ["$_refilled", cost]}, "$_refilled",
+                    ]},
+                    "expires_at": {"$add": ["$$NOW", int(burst / rate * 1000)]},
+                }},
+                {"$unset": "_refilled"},
+            ],
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / rate
+
+    def stats(self):
+        return {"backend": "mongo", "collection": self.collection.name}
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger("trolixve.retention")
+
+
+class HistoryCompactor:
+    """Periodic compaction of terminal history.
+
+    Every `interval` seconds each sandbox's history is trimmed to its newest
+    `max_entries` entries (0 keeps everything), large outputs still stored
+    inline are moved into deduplicated blobs and blobs nothing refers to
+    any more are deleted. Age-based expiry is left to the TTL index.
+    """
+
+    def __init__(self, sessions, max_entries=0, interval=3600, batch_size=500):
+        self.sessions = sessions
+        self.max_entries = max_entries
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.failed_runs = 0
+        self.trimmed = 0
+        self.compacted = 0
+        self.collected = 0
+        self.last_run = None
+        self.last_duration = None
+        self._lock = None
+        self._task = None
+
+    def start(self):
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def compact(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            if self.max_entries:
+                self.trimmed += await self.sessions.trim(self.max_entries)
+            self.compacted += await self.sessions.compact_outputs(self.batch_size)
+            self.collected += await self.sessions.collect_outputs()
+            self.runs += 1
+            self.last_run = datetime.now(timezone.utc)
+            self.last_duration = round(loop.time() - started, 3)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "max_entries": self.max_entries,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "trimmed": self.trimmed,
+            "compacted": self.compacted,
+            "collected": self.collected,
+            "last_run": self.last_run,
+            "last_duration_s": self.last_duration,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_runs += 1
+                logger.exception("History compaction failed")
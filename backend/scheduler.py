@@ -0,0 +1,201 @@
+import asyncio
+import os
+import shutil
+from collections import OrderedDict
+
+RESOURCES = ("cpu_cores", "ram_gb", "disk_gb")
+# A sandbox holds CPU and RAM while it is being provisioned or running; its
+# disk stays reserved until it is deleted.
+COMPUTE_RESOURCES = ("cpu_cores", "ram_gb")
+COMPUTE_STATUSES = ("creating", "running")
+
+
+class CapacityError(Exception):
+    pass
+
+
+def detect_capacity():
+    """CPU cores, RAM and disk (in GB) of the machine running the API."""
+    try:
+        ram_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        ram_bytes = 16 * 2**30
+    return {
+        "cpu_cores": os.cpu_count() or 1,
+        "ram_gb": ram_bytes // 2**30,
+        "disk_gb": shutil.disk_usage("/").total // 2**30,
+    }
+
+
+class Allocation:
+    __slots__ = ("request", "compute")
+
+    def __init__(self, request, compute):
+        self.request = request
+        self.compute = compute
+
+
+class ResourceScheduler:
+    """Admission control for sandboxes against one host's resources.
+
+    Each resource may be reserved up to `capacity * overcommit`. Creations
+    wait in `admit` until their request fits and are admitted first-fit in
+    arrival order as capacity is released; starts are either claimed at
+    once or refused. Releases are driven by `observe`, an EventBus listener
+    following the sandboxes' status changes.
+    """
+
+    def __init__(self, capacity, overcommit=None):
+        overcommit = overcommit or {}
+        self.capacity = {resource: capacity[resource] for resource in RESOURCES}
+        self.overcommit = {resource: overcommit.get(resource, 1.0) for resource in RESOURCES}
+        self.allocatable = {
+            resource: self.capacity[resource] * self.overcommit[resource] for resource in RESOURCES
+        }
+        self.allocated = dict.fromkeys(RESOURCES, 0)
+        self.allocations = {}
+        self.waiters = OrderedDict()
+        self.refused = 0
+
+    @staticmethod
+    def request_of(sandbox):
+        return {resource: sandbox.get(resource) or 0 for resource in RESOURCES}
+
+    def check(self, request):
+        """Raises CapacityError for a request the host could never admit."""
+        too_big = [resource for resource in RESOURCES if request[resource] > self.allocatable[resource]]
+        if too_big:
+            raise CapacityError(
+                "Request exceeds host capacity: "
+                + ", ".join(f"{resource} {request[resource]} > {self.allocatable[resource]:g}" for resource in too_big)
+            )
+
+    def load(self, sandboxes):
+        """Rebuilds allocations from stored sandboxes.
+
+        Sandboxes left in "creating" by a previous process keep their CPU
+        and RAM reserved, since nothing tells us whether they got any.
+        """
+        self.allocations.clear()
+        self.allocated = dict.fromkeys(RESOURCES, 0)
+        for sandbox in sandboxes:
+            if sandbox.get("status") == "error":
+                continue
+            request = self.request_of(sandbox)
+            allocation = Allocation(request, sandbox.get("status") in COMPUTE_STATUSES)
+            self.allocations[sandbox["id"]] = allocation
+            for resource in RESOURCES:
+                if allocation.compute or resource not in COMPUTE_RESOURCES:
+                    self.allocated[resource] += request[resource]
+
+    def _delta(self, sandbox_id, request):
+        allocation = self.allocations.get(sandbox_id)
+        if allocation is None:
+            return dict(request)
+        if allocation.compute:
+            return dict.fromkeys(RESOURCES, 0)
+        return {
+            resource: allocation.request[resource] if resource in COMPUTE_RESOURCES else 0
+            for resource in RESOURCES
+        }
+
+    def _fits(self, delta):
+        return all(
+            self.allocated[resource] + delta[resource] <= self.allocatable[resource]
+            for resource in RESOURCES
+            if delta[resource]
+        )
+
+    def _reserve(self, sandbox_id, request, delta):
+        for resource in RESOURCES:
+            self.allocated[resource] += delta[resource]
+        allocation = self.allocations.get(sandbox_id)
+        if allocation is None:
+            self.allocations[sandbox_id] = Allocation(dict(request), True)
+        else:
+            allocation.compute = True
+
+    def try_claim(self, sandbox_id, request):
+        """Reserves what a sandbox needs to run; returns False if it does not fit."""
+        delta = self._delta(sandbox_id, request)
+        if not self._fits(delta):
+            self.refused += 1
+            return False
+        self._reserve(sandbox_id, request, delta)
+        return True
+
+    async def admit(self, sandbox_id, request):
+        """Waits until a new sandbox fits.
+
+        Returns False when the sandbox was released (deleted or failed)
+        while it was waiting.
+        """
+        delta = self._delta(sandbox_id, request)
+        # Waiters are re-checked on every release, so any left don't fit now
+        # and a request that does can go ahead of them
+        if self._fits(delta):
+            self._reserve(sandbox_id, request, delta)
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[sandbox_id] = (request, future)
+        try:
+            return await future
+        finally:
+            self.waiters.pop(sandbox_id, None)
+
+    def _wake(self):
+        for sandbox_id, (request, future) in list(self.waiters.items()):
+            if future.done():
+                continue
+            delta = self._delta(sandbox_id, request)
+            if self._fits(delta):
+                self._reserve(sandbox_id, request, delta)
+                future.set_result(True)
+
+    def release_compute(self, sandbox_id):
+        allocation = self.allocations.get(sandbox_id)
+        if allocation is None or not allocation.compute:
+            return
+        allocation.compute = False
+        for resource in COMPUTE_RESOURCES:
+            self.allocated[resource] -= allocation.request[resource]
+        self._wake()
+
+    def release(self, sandbox_id):
+        waiter = self.waiters.get(sandbox_id)
+        if waiter is not None and not waiter[1].done():
+            waiter[1].set_result(False)
+        allocation = self.allocations.pop(sandbox_id, None)
+        if allocation is None:
+            return
+        for resource in RESOURCES:
+            if allocation.compute or resource not in COMPUTE_RESOURCES:
+                self.allocated[resource] -= allocation.request[resource]
+        self._wake()
+
+    def observe(self, event):
+        if event["type"] == "sandbox.deleted":
+            self.release(event["sandbox_id"])
+        elif event["type"] == "sandbox.updated":
+            status = event["data"]["changes"].get("status")
+            if status in ("stopped", "saved", "warm"):
+                self.release_compute(event["sandbox_id"])
+            elif status == "error":
+                self.release(event["sandbox_id"])
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "overcommit": self.overcommit,
+            "allocatable": self.allocatable,
+            "allocated": dict(self.allocated),
+            "utilisation": {
+                resource: round(self.allocated[resource] / self.allocatable[resource], 4)
+                if self.allocatable[resource] else 0.0
+                for resource in RESOURCES
+            },
+            "sandboxes": len(self.allocations),
+            "running": sum(1 for allocation in self.allocations.values() if allocation.compute),
+            "waiting": len(self.waiters),
+            "refused": self.refused,
+        }
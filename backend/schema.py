@@ -0,0 +1,119 @@
+import logging
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger("trolixve.schema")
+
+# Indexes every deployment is expected to have, per collection
+INDEXES = {
+    "sandboxes": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("id", ASCENDING)], name="status_id"),
+        IndexModel([("status", ASCENDING), ("last_accessed", ASCENDING)], name="status_last_accessed"),
+        IndexModel(
+            [("pool", ASCENDING), ("os_type", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING)],
+            name="pool_os_type_status_created_at",
+            sparse=True,
+        ),
+        IndexModel([("os_type", ASCENDING)], name="os_type"),
+    ],
+    "sessions": [
+        IndexModel(
+            [("sandbox_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+            name="sandbox_id_timestamp",
+        ),
+        IndexModel([("output_ref", ASCENDING)], name="output_ref", sparse=True),
+    ],
+    "shells": [
+        IndexModel([("sandbox_id", ASCENDING)], name="sandbox_id_unique", unique=True),
+    ],
+    "shell_files": [
+        IndexModel([("sandbox_id", ASCENDING), ("path", ASCENDING)], name="sandbox_id_path_unique", unique=True),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "snapshots": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("sandbox_id", ASCENDING), ("created_at", ASCENDING)], name="sandbox_id_created_at"),
+    ],
+}
+
+# Fields that used to be stored as ISO strings and are now BSON dates
+DATE_FIELDS = {
+    "sandboxes": ["created_at", "last_accessed"],
+    "sessions": ["timestamp"],
+}
+
+
+async def ensure_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as exc:
+            logger.error("Could not create indexes on %s: %s", collection_name, exc)
+
+
+HISTORY_TTL_INDEX = "timestamp_ttl"
+
+
+async def ensure_history_ttl(db, ttl_seconds):
+    """Creates, updates or (for a ttl of 0) drops the sessions TTL index."""
+    sessions = db.sessions
+    try:
+        existing = await sessions.index_information()
+        if not ttl_seconds:
+            if HISTORY_TTL_INDEX in existing:
+                await sessions.drop_index(HISTORY_TTL_INDEX)
+            return
+        ttl_seconds = int(ttl_seconds)
+        if HISTORY_TTL_INDEX not in existing:
+            await sessions.create_index(
+                [("timestamp", ASCENDING)], name=HISTORY_TTL_INDEX, expireAfterSeconds=ttl_seconds
+            )
+        elif existing[HISTORY_TTL_INDEX].get("expireAfterSeconds") != ttl_seconds:
+            await db.command("collMod", "sessions", index={"name": HISTORY_TTL_INDEX, "expireAfterSeconds": ttl_seconds})
+            logger.info("Changed history TTL to %d seconds", ttl_seconds)
+    except OperationFailure as exc:
+        logger.error("Could not set the history TTL: %s", exc)
+
+
+async def missing_indexes(db):
+    """Names of the expected indexes that do not exist, per collection."""
+    missing = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = set()
+        async for index in db[collection_name].list_indexes():
+            existing.add(tuple(index["key"].items()))
+        names = [
+            index.document["name"]
+            for index in indexes
+            if tuple(index.document["key"].items()) not in existing
+        ]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+async def migrate_dates(db):
+    """Converts legacy ISO string timestamps to BSON dates in place."""
+    for collection_name, fields in DATE_FIELDS.items():
+        for field in fields:
+            try:
+                result = await db[collection_name].update_many(
+                    {field: {"$type": "string"}},
+                    [{"$set": {field: {"$toDate": f"${field}"}}}],
+                )
+            except OperationFailure as exc:
+                logger.error("Could not convert %s.%s to dates: %s", collection_name, field, exc)
+                continue
+            if result.modified_count:
+                logger.info("Converted %d %s.%s values to dates", result.modified_count, collection_name, field)
+
+
+async def migrate(db, history_ttl=0):
+    await migrate_dates(db)
+    await ensure_indexes(db)
+    await ensure_history_ttl(db, history_ttl)
@@ -1,30 +1,188 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from pymongo import MongoClient
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import asyncio
 import os
+import time
 import uuid
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import List, Literal, Optional
 import json
 
+from cache import TTLCache
+from commands import create_dispatcher
+from events import EventBus
+from history_writer import HistoryWriter
+from metrics import MetricsRegistry, MongoCommandMetrics, MongoPoolMetrics, Timer
+from provisioning import ProvisioningQueue, QueueFullError
+from ratelimit import Limit, RateLimited, RateLimiter, TokenBuckets
+from reaper import IdleReaper
+from retention import HistoryCompactor
+from repository import (
+    SandboxRepository,
+    RateLimitRepository,
+    SessionRepository,
+    ShellRepository,
+    SnapshotRepository,
+    create_client,
+    mongo_client_options,
+)
+from scheduler import CapacityError, ResourceScheduler, detect_capacity
+from schema import migrate, missing_indexes
+from shell import ShellEngine
+from snapshots import ChunkStore, SnapshotEngine
+from warm_pool import WarmPool, parse_sizes
+
 app = FastAPI(title="TrolixVE API", version="1.0.0")
 
-# CORS middleware
+# Metrics
+metrics = MetricsRegistry()
+request_latency = metrics.histogram(
+    "trolixve_http_request_duration_seconds",
+    "Time to produce the response headers, by route.",
+    labels=("method", "route", "status"),
+)
+dispatch_latency = metrics.histogram(
+    "trolixve_command_dispatch_seconds",
+    "Time to run a terminal command, loading and saving shell state included.",
+    labels=("os_type",),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+mongo_commands = MongoCommandMetrics(metrics)
+mongo_pool = MongoPoolMetrics(metrics, mongo_client_options()["maxPoolSize"])
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template so ids in the path don't create new series
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    request_latency.observe(time.perf_counter() - started, request.method, path, response.status_code)
+    return response
+
+# MongoDB connection
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+client = create_client(MONGO_URL, event_listeners=[mongo_commands, mongo_pool])
+db = client.trollixve_db
+sandboxes_collection = db.sandboxes
+sessions_collection = db.sessions
+sandbox_cache = TTLCache(
+    maxsize=int(os.environ.get('SANDBOX_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('SANDBOX_CACHE_TTL', '30')),
+)
+sandbox_events = EventBus(
+    buffer_size=int(os.environ.get('EVENTS_BUFFER_SIZE', '1000')),
+    max_queued=int(os.environ.get('EVENTS_MAX_QUEUED', '1000')),
+)
+sandboxes = SandboxRepository(sandboxes_collection, cache=sandbox_cache, events=sandbox_events)
+# Outputs shorter than a blob reference (a 64-character digest) stay inline,
+# so every canned command output but the shortest ones is deduplicated
+sessions = SessionRepository(
+    sessions_collection,
+    outputs=db.outputs,
+    dedup_min_bytes=int(os.environ.get('HISTORY_DEDUP_MIN_BYTES', '64')),
+    compress_min_bytes=int(os.environ.get('HISTORY_COMPRESS_MIN_BYTES', '4096')),
+    blob_cache_size=int(os.environ.get('HISTORY_BLOB_CACHE_SIZE', '1000')),
+)
+
+# Rate limits and concurrency caps per client, and per sandbox for commands.
+# Clients are told apart by the address in X-Forwarded-For, which the
+# preview ingress sets; set RATE_LIMIT_TRUST_PROXY=false when the API is
+# reached directly, or any client could pick its own key with that header
+terminal_limit = Limit(
+    "terminal",
+    rate=float(os.environ.get('TERMINAL_RATE', '10')),
+    burst=int(os.environ.get('TERMINAL_BURST', '30')),
+    client_concurrency=int(os.environ.get('TERMINAL_CLIENT_CONCURRENCY', '8')),
+    sandbox_concurrency=int(os.environ.get('TERMINAL_SANDBOX_CONCURRENCY', '2')),
+)
+provisioning_limit = Limit(
+    "provisioning",
+    rate=float(os.environ.get('PROVISIONING_RATE', '2')),
+    burst=int(os.environ.get('PROVISIONING_BURST', '30')),
+    client_concurrency=int(os.environ.get('PROVISIONING_CLIENT_CONCURRENCY', '4')),
+)
+if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo':
+    rate_limit_buckets = RateLimitRepository(db.rate_limits)
+else:
+    rate_limit_buckets = TokenBuckets(max_keys=int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000')))
+rate_limiter = RateLimiter(
+    rate_limit_buckets,
+    [
+        ("POST", r"/api/terminal/execute", terminal_limit),
+        ("POST", r"/api/sandboxes", provisioning_limit),
+        ("POST", r"/api/sandboxes/bulk", provisioning_limit),
+        ("POST", r"/api/sandboxes/actions", provisioning_limit),
+        ("POST", r"/api/sandboxes/(?P<sandbox_id>[^/]+)/(start|stop|save)", provisioning_limit),
+        ("POST", r"/api/snapshots/[^/]+/restore", provisioning_limit),
+    ],
+    trust_proxy=os.environ.get('RATE_LIMIT_TRUST_PROXY', 'true').lower() in ('1', 'true', 'yes'),
+)
+
+async def body_sandbox_id(request: Request):
+    try:
+        return json.loads(await request.body()).get("sandbox_id")
+    except (ValueError, AttributeError):
+        return None
+
+@app.middleware("http")
+async def limit_rates(request: Request, call_next):
+    limit, sandbox_id = rate_limiter.match(request.method, request.url.path)
+    if limit is None:
+        return await call_next(request)
+    if sandbox_id is None and limit.sandbox_concurrency:
+        sandbox_id = await body_sandbox_id(request)
+    try:
+        held = await rate_limiter.acquire(limit, rate_limiter.client_of(request), sandbox_id)
+    except RateLimited as exc:
+        return JSONResponse(
+            {"detail": str(exc)}, status_code=429, headers={"Retry-After": exc.retry_after_header}
+        )
+    try:
+        return await call_next(request)
+    finally:
+        rate_limiter.release(held)
+
+# CORS middleware, added last so that it wraps the others and 429s carry its headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Has-More"],
 )
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = MongoClient(MONGO_URL)
-db = client.trollixve_db
-sandboxes_collection = db.sandboxes
-sessions_collection = db.sessions
+# Host capacity available to sandboxes, detected unless configured
+host_capacity = detect_capacity()
+scheduler = ResourceScheduler(
+    {
+        "cpu_cores": float(os.environ.get('HOST_CPU_CORES', host_capacity["cpu_cores"])),
+        "ram_gb": float(os.environ.get('HOST_RAM_GB', host_capacity["ram_gb"])),
+        "disk_gb": float(os.environ.get('HOST_DISK_GB', host_capacity["disk_gb"])),
+    },
+    overcommit={
+        "cpu_cores": float(os.environ.get('SCHEDULER_CPU_OVERCOMMIT', '4')),
+        "ram_gb": float(os.environ.get('SCHEDULER_RAM_OVERCOMMIT', '1')),
+        "disk_gb": float(os.environ.get('SCHEDULER_DISK_OVERCOMMIT', '1')),
+    },
+)
+sandbox_events.listen(scheduler.observe)
+metrics.gauge(
+    "trolixve_scheduler_allocated",
+    "Resources reserved by sandboxes.",
+    lambda: {(resource,): value for resource, value in scheduler.allocated.items()},
+    labels=("resource",),
+)
+metrics.gauge(
+    "trolixve_scheduler_allocatable",
+    "Resources sandboxes may reserve, overcommit included.",
+    lambda: {(resource,): value for resource, value in scheduler.allocatable.items()},
+    labels=("resource",),
+)
 
 # Pydantic models
 class SandboxConfig(BaseModel):
@@ -34,6 +192,7 @@ class SandboxConfig(BaseModel):
     ram_gb: int = 4
     disk_gb: int = 20
     network_isolated: bool = True
+    snapshot_id: Optional[str] = None
     
 class Sandbox(BaseModel):
     id: str
@@ -44,9 +203,24 @@ class Sandbox(BaseModel):
     ram_gb: int
     disk_gb: int
     network_isolated: bool
-    created_at: str
-    last_accessed: str
+    created_at: datetime
+    last_accessed: datetime
     uptime: int = 0
+    cloned_from: Optional[str] = None
+
+class BulkSandboxConfig(BaseModel):
+    config: SandboxConfig
+    count: int = Field(default=1, ge=1, le=100)
+
+class BulkSandboxSelector(BaseModel):
+    status: Optional[str] = None
+    os_type: Optional[str] = None
+    created_before: Optional[datetime] = None
+
+class BulkSandboxAction(BaseModel):
+    action: Literal["start", "stop", "save", "delete"]
+    ids: Optional[List[str]] = Field(default=None, max_length=5000)
+    selector: Optional[BulkSandboxSelector] = None
 
 class TerminalCommand(BaseModel):
     sandbox_id: str
@@ -66,158 +240,770 @@ OS_TEMPLATES = {
     "arch": {"name": "Arch Linux", "icon": "⚡", "color": "#1793d1"},
 }
 
-# Simulated command responses
-COMMAND_RESPONSES = {
-    "ls": "bin  boot  dev  etc  home  lib  media  mnt  opt  proc  root  run  sbin  srv  sys  tmp  usr  var",
-    "whoami": "root",
-    "pwd": "/root",
-    "uname -a": "Linux sandbox-{id} 5.15.0-kali3-amd64 #1 SMP Debian 5.15.15-2kali1 x86_64 GNU/Linux",
-    "ps aux": "USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND\nroot         1  0.0  0.1  19312  1604 ?        Ss   12:00   0:00 /sbin/init",
-    "ip a": "1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN\n    inet 127.0.0.1/8 scope host lo",
-    "df -h": "Filesystem      Size  Used Avail Use% Mounted on\n/dev/sda1        20G  2.1G   17G  12% /",
-    "free -h": "               total        used        free      shared  buff/cache   available\nMem:           4.0Gi       234Mi       3.4Gi        12Mi       356Mi       3.5Gi",
-    "netstat": "Active Internet connections (only servers)\nProto Recv-Q Send-Q Local Address           Foreign Address         State",
-    "help": "Available commands: ls, pwd, whoami, uname, ps, ip, df, free, netstat, nmap, metasploit, sqlmap, hashcat, john, aircrack-ng"
+dispatcher = create_dispatcher(OS_TEMPLATES)
+shells = ShellEngine(
+    ShellRepository(db.shells, db.shell_files),
+    dispatcher,
+    cache_size=int(os.environ.get('SHELL_CACHE_SIZE', '5000')),
+    ttl=float(os.environ.get('SHELL_CACHE_TTL', '3600')),
+)
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+# Background provisioning
+PROVISIONING_WORKERS = int(os.environ.get('PROVISIONING_WORKERS', '4'))
+PROVISIONING_DELAY = float(os.environ.get('PROVISIONING_DELAY', '2'))
+PROVISIONING_MAX_PENDING = int(os.environ.get('PROVISIONING_MAX_PENDING', '1000'))
+
+async def provision_sandbox(sandbox_id: str):
+    sandbox = await sandboxes.get(sandbox_id)
+    if sandbox is None or sandbox["status"] != "creating":
+        return
+    try:
+        await build_sandbox(sandbox)
+    except Exception:
+        # Fail the sandbox too, which releases its resources and takes a
+        # pooled one out of the pool count; the job records the error
+        await sandboxes.update(sandbox_id, {"status": "error"}, expected_status="creating")
+        raise
+
+async def build_sandbox(sandbox: dict):
+    sandbox_id = sandbox["id"]
+    snapshot = await snapshot_records.get(sandbox["cloned_from"]) if sandbox.get("cloned_from") else None
+    if snapshot is not None:
+        await snapshot_engine.restore(snapshot, sandbox, clone=True)
+    else:
+        # Simulate creation delay without holding the event loop
+        await asyncio.sleep(PROVISIONING_DELAY)
+    if sandbox.get("pool"):
+        await sandboxes.update(sandbox_id, {"status": "warm"}, expected_status="creating")
+        return
+    await sandboxes.update(
+        sandbox_id, {"status": "running", "uptime_updated_at": utcnow()}, expected_status="creating"
+    )
+
+async def admit_sandbox(sandbox_id: str):
+    """Waits until the host has room for a sandbox, outside the provisioning workers."""
+    sandbox = await sandboxes.get(sandbox_id)
+    if sandbox is None or sandbox["status"] != "creating":
+        return False
+    return await scheduler.admit(sandbox_id, ResourceScheduler.request_of(sandbox))
+
+provisioning_queue = ProvisioningQueue(
+    provision_sandbox,
+    admit=admit_sandbox,
+    workers=PROVISIONING_WORKERS,
+    max_pending=PROVISIONING_MAX_PENDING,
+)
+
+# History retention is off unless configured: HISTORY_TTL_DAYS=30 expires
+# entries older than 30 days through a TTL index, HISTORY_MAX_ENTRIES=10000
+# keeps each sandbox's newest 10000 entries. Both delete existing history on
+# the next startup (TTL) or compaction run (entries) once set.
+@app.on_event("startup")
+async def migrate_schema():
+    await migrate(db, history_ttl=float(os.environ.get('HISTORY_TTL_DAYS', '0')) * 86400)
+
+@app.on_event("startup")
+async def load_allocations():
+    scheduler.load(await sandboxes.resources())
+
+@app.on_event("startup")
+async def start_provisioning():
+    provisioning_queue.start()
+
+@app.on_event("startup")
+async def resume_provisioning():
+    # Jobs only live in memory: give the sandboxes a previous process left
+    # in "creating" new ones, or they would never leave that status
+    async for batch in sandboxes.ids_with_status("creating"):
+        for sandbox_id in batch:
+            try:
+                await queue_provisioning(sandbox_id)
+            except HTTPException:
+                pass
+
+@app.on_event("shutdown")
+async def stop_provisioning():
+    await provisioning_queue.stop()
+
+# Write-behind terminal history
+history_writer = HistoryWriter(
+    sessions.add_many,
+    batch_size=int(os.environ.get('HISTORY_BATCH_SIZE', '100')),
+    flush_interval=float(os.environ.get('HISTORY_FLUSH_INTERVAL', '0.5')),
+    max_pending=int(os.environ.get('HISTORY_MAX_PENDING', '10000')),
+)
+
+@app.on_event("startup")
+async def start_history_writer():
+    history_writer.start()
+
+@app.on_event("shutdown")
+async def stop_history_writer():
+    await history_writer.stop()
+
+# Snapshots: sandbox state stored as content-addressed chunks on local disk
+snapshot_records = SnapshotRepository(db.snapshots)
+snapshot_engine = SnapshotEngine(
+    ChunkStore(
+        os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot_data')),
+        chunk_size=int(os.environ.get('SNAPSHOT_CHUNK_SIZE', str(64 * 1024))),
+    ),
+    snapshot_records,
+    cache_size=int(os.environ.get('SNAPSHOT_CACHE_SIZE', '32')),
+)
+
+# Clones take these from the snapshot instead of the request
+CLONED_FIELDS = ["os_type", "cpu_cores", "ram_gb", "disk_gb", "network_isolated"]
+
+async def capture_config(sandbox: dict):
+    return {field: sandbox[field] for field in CLONED_FIELDS}
+
+async def restore_environment(sandbox: dict, environment: dict, clone: bool):
+    await shells.restore_environment(sandbox["id"], environment)
+
+async def restore_files(sandbox: dict, files: dict, clone: bool):
+    await shells.restore_files(sandbox["id"], files)
+
+async def capture_history_cursor(sandbox: dict):
+    if history_writer.has_pending(sandbox["id"]):
+        await history_writer.flush()
+    history, _ = await sessions.page(sandbox["id"], limit=1, newest=True)
+    return sessions.cursor_for(history[-1]) if history else None
+
+async def restore_history_cursor(sandbox: dict, cursor: Optional[str], clone: bool):
+    # Clones start with an empty history; the original goes back to the cursor
+    if clone:
+        return
+    if history_writer.has_pending(sandbox["id"]):
+        await history_writer.flush()
+    await sessions.delete_after(sandbox["id"], cursor)
+
+snapshot_engine.register("config", capture_config, None)
+snapshot_engine.register("environment", shells.capture_environment, restore_environment)
+snapshot_engine.register("filesystem", shells.capture_files, restore_files, split=True)
+snapshot_engine.register("history_cursor", capture_history_cursor, restore_history_cursor)
+
+def snapshot_summary(snapshot: dict):
+    return {key: value for key, value in snapshot.items() if key not in ("_id", "entries")}
+
+async def snapshot_sandboxes(sandbox_ids: List[str]):
+    for sandbox_id in sandbox_ids:
+        sandbox = await sandboxes.get(sandbox_id)
+        if sandbox:
+            await snapshot_engine.create(sandbox)
+
+# Uptime accounting and idle sandbox reaping
+reaper = IdleReaper(
+    sandboxes,
+    idle_after=float(os.environ.get('IDLE_AFTER', '1800')),
+    action=os.environ.get('IDLE_ACTION', 'save'),
+    interval=float(os.environ.get('REAPER_INTERVAL', '60')),
+    batch_size=int(os.environ.get('REAPER_BATCH_SIZE', '500')),
+    on_save=snapshot_sandboxes,
+)
+
+@app.on_event("startup")
+async def start_reaper():
+    reaper.start()
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    await reaper.stop()
+
+# History compaction, and trimming when HISTORY_MAX_ENTRIES is set
+history_compactor = HistoryCompactor(
+    sessions,
+    max_entries=int(os.environ.get('HISTORY_MAX_ENTRIES', '0')),
+    interval=float(os.environ.get('HISTORY_COMPACT_INTERVAL', '3600')),
+    batch_size=int(os.environ.get('HISTORY_COMPACT_BATCH_SIZE', '500')),
+)
+
+@app.on_event("startup")
+async def start_history_compactor():
+    history_compactor.start()
+
+@app.on_event("shutdown")
+async def stop_history_compactor():
+    await history_compactor.stop()
+
+def new_sandbox_document(config: SandboxConfig, name: Optional[str] = None):
+    now = utcnow()
+    return {
+        "id": str(uuid.uuid4()),
+        "name": name or config.name,
+        "os_type": config.os_type,
+        "status": "creating",
+        "cpu_cores": config.cpu_cores,
+        "ram_gb": config.ram_gb,
+        "disk_gb": config.disk_gb,
+        "network_isolated": config.network_isolated,
+        "created_at": now,
+        "last_accessed": now,
+        "uptime": 0,
+        "cloned_from": config.snapshot_id,
+    }
+
+async def queue_provisioning(sandbox_id: str):
+    try:
+        return provisioning_queue.submit(sandbox_id)
+    except QueueFullError:
+        await sandboxes.update(sandbox_id, {"status": "error"})
+        raise HTTPException(status_code=503, detail="Provisioning queue is full, retry later")
+
+# Warm pool of provisioned sandboxes per OS template
+WARM_POOL_SPEC = {
+    "cpu_cores": SandboxConfig.model_fields["cpu_cores"].default,
+    "ram_gb": SandboxConfig.model_fields["ram_gb"].default,
+    "disk_gb": SandboxConfig.model_fields["disk_gb"].default,
 }
 
+async def fill_warm_pool(os_type: str, count: int):
+    config = SandboxConfig(name=f"warm-{os_type}", os_type=os_type, **WARM_POOL_SPEC)
+    pooled = await sandboxes.insert_many([{**new_sandbox_document(config), "pool": True} for _ in range(count)])
+    for sandbox in pooled:
+        try:
+            provisioning_queue.submit(sandbox["id"])
+        except QueueFullError:
+            await sandboxes.delete(sandbox["id"])
+
+warm_pool = WarmPool(
+    sandboxes,
+    scheduler,
+    fill_warm_pool,
+    sizes=parse_sizes(os.environ.get('WARM_POOL_SIZES', 'kali:2,ubuntu:2')),
+    spec=WARM_POOL_SPEC,
+    interval=float(os.environ.get('WARM_POOL_INTERVAL', '5')),
+)
+metrics.gauge(
+    "trolixve_warm_pool_hit_rate",
+    "Share of creations served from the warm pool.",
+    lambda: {(os_type,): pool["hit_rate"] for os_type, pool in warm_pool.stats()["pools"].items()},
+    labels=("os_type",),
+)
+
+@app.on_event("startup")
+async def start_warm_pool():
+    warm_pool.start()
+
+@app.on_event("shutdown")
+async def stop_warm_pool():
+    await warm_pool.stop()
+
+async def take_warm(config: SandboxConfig, name: str):
+    if config.snapshot_id:
+        return None
+    now = utcnow()
+    return await warm_pool.take(config.os_type, ResourceScheduler.request_of(config.model_dump()), {
+        "name": name,
+        "network_isolated": config.network_isolated,
+        "status": "running",
+        "created_at": now,
+        "last_accessed": now,
+        "uptime_updated_at": now,
+        "cloned_from": None,
+    })
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "online", "service": "TrolixVE"}
 
+@app.get("/api/health/db")
+async def database_check():
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+    except Exception as exc:
+        return {"status": "unreachable", "detail": str(exc), "pool": mongo_pool.stats()}
+    return {
+        "status": "online",
+        "ping_ms": round((time.perf_counter() - started) * 1000, 3),
+        "pool": mongo_pool.stats(),
+    }
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/health/indexes")
+async def index_check():
+    missing = await missing_indexes(db)
+    return {"status": "ok" if not missing else "missing_indexes", "missing": missing}
+
+@app.get("/api/health/history-writer")
+async def history_writer_stats():
+    return history_writer.stats()
+
+@app.get("/api/health/retention")
+async def history_retention_stats():
+    return history_compactor.stats()
+
+@app.get("/api/health/snapshots")
+async def snapshot_stats():
+    return await snapshot_engine.stats()
+
+@app.get("/api/health/warm-pool")
+async def warm_pool_stats():
+    return warm_pool.stats()
+
+@app.get("/api/health/shells")
+async def shell_stats():
+    return shells.stats()
+
+@app.get("/api/health/rate-limits")
+async def rate_limit_stats():
+    return rate_limiter.stats()
+
+@app.get("/api/health/reaper")
+async def reaper_stats():
+    return reaper.stats()
+
+@app.get("/api/health/cache")
+async def sandbox_cache_stats():
+    return sandbox_cache.stats()
+
+EVENTS_HEARTBEAT_INTERVAL = float(os.environ.get('EVENTS_HEARTBEAT_INTERVAL', '15'))
+
+def format_sse(event):
+    data = json.dumps(jsonable_encoder(event))
+    return f"id: {sandbox_events.event_id(event['seq'])}\nevent: {event['type']}\ndata: {data}\n\n"
+
+@app.get("/api/events")
+async def sandbox_event_stream(request: Request, since: Optional[int] = None):
+    # EventSource sends the last id it saw when it reconnects
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id:
+        since = sandbox_events.parse_event_id(last_event_id)
+
+    subscription, reset = sandbox_events.subscribe(since)
+
+    async def stream():
+        try:
+            if reset or since is None:
+                # Tell the client where the feed starts so it can resume from here
+                yield format_sse({"seq": sandbox_events.seq, "type": "reset" if reset else "hello"})
+            while not subscription.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), EVENTS_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+            yield format_sse({"seq": sandbox_events.seq, "type": "reset"})
+        finally:
+            sandbox_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/health/events")
+async def event_bus_stats():
+    return sandbox_events.stats()
+
 @app.get("/api/os-templates")
 async def get_os_templates():
     return OS_TEMPLATES
 
+SANDBOX_FIELDS = set(Sandbox.model_fields)
+# Warm-pool sandboxes are not the user's until handed out
+NOT_POOLED = {"pool": {"$ne": True}}
+
+def sandbox_filters(status: Optional[str], os_type: Optional[str]):
+    filters = {}
+    if status:
+        filters["status"] = {"$in": status.split(",")}
+    if os_type:
+        filters["os_type"] = {"$in": os_type.split(",")}
+    return filters
+
 @app.get("/api/sandboxes")
-async def get_sandboxes():
-    sandboxes = []
-    for doc in sandboxes_collection.find():
-        doc['_id'] = str(doc['_id'])
-        sandboxes.append(doc)
-    return sandboxes
+async def get_sandboxes(
+    response: Response,
+    status: Optional[str] = None,
+    os_type: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    projection = None
+    if fields:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(projection) - SANDBOX_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    try:
+        page, next_cursor = await sandboxes.page(
+            {**sandbox_filters(status, os_type), **NOT_POOLED}, limit=limit, cursor=cursor, fields=projection
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return page
+
+@app.get("/api/sandboxes/summary")
+async def get_sandboxes_summary(status: Optional[str] = None, os_type: Optional[str] = None):
+    by_status = await sandboxes.count_by_status({**sandbox_filters(status, os_type), **NOT_POOLED})
+    return {"total": sum(by_status.values()), "by_status": by_status}
+
+async def clone_config(config: SandboxConfig):
+    """The config with the OS and resources of the snapshot it clones, if any."""
+    if not config.snapshot_id:
+        return config
+    snapshot = await snapshot_records.get(config.snapshot_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    state = await snapshot_engine.load(snapshot)
+    return config.model_copy(update=state["config"])
+
+def check_capacity(config: SandboxConfig):
+    try:
+        scheduler.check(ResourceScheduler.request_of(config.model_dump()))
+    except CapacityError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
 
 @app.post("/api/sandboxes")
 async def create_sandbox(config: SandboxConfig):
-    sandbox = {
-        "id": str(uuid.uuid4()),
-        "name": config.name,
-        "os_type": config.os_type,
-        "status": "creating",
-        "cpu_cores": config.cpu_cores,
-        "ram_gb": config.ram_gb,
-        "disk_gb": config.disk_gb,
-        "network_isolated": config.network_isolated,
-        "created_at": datetime.now().isoformat(),
-        "last_accessed": datetime.now().isoformat(),
-        "uptime": 0
+    config = await clone_config(config)
+    check_capacity(config)
+    warm = await take_warm(config, config.name)
+    if warm is not None:
+        return {
+            "message": "Sandbox ready from the warm pool",
+            "sandbox_id": warm["id"],
+            "job_id": None,
+            "status": warm["status"]
+        }
+    sandbox = await sandboxes.insert(new_sandbox_document(config))
+    job = await queue_provisioning(sandbox["id"])
+
+    return {
+        "message": "Sandbox creation started",
+        "sandbox_id": sandbox["id"],
+        "job_id": job["id"],
+        "status": sandbox["status"]
     }
-    
-    result = sandboxes_collection.insert_one(sandbox)
-    
-    # Simulate creation delay
-    import time
-    time.sleep(2)
-    
-    # Update status to running
-    sandboxes_collection.update_one(
-        {"id": sandbox["id"]}, 
-        {"$set": {"status": "running"}}
-    )
-    
-    return {"message": "Sandbox created successfully", "sandbox_id": sandbox["id"]}
+
+@app.post("/api/sandboxes/bulk")
+async def create_sandboxes_bulk(request: BulkSandboxConfig):
+    config = await clone_config(request.config)
+    check_capacity(config)
+    created = []
+    names = [f"{config.name}-{i + 1}" for i in range(request.count)]
+    # Serve from the warm pool until it runs dry, then create the rest
+    while names:
+        warm = await take_warm(config, names[0])
+        if warm is None:
+            break
+        created.append({"sandbox_id": warm["id"], "job_id": None, "status": warm["status"]})
+        names.pop(0)
+    new_sandboxes = await sandboxes.insert_many([new_sandbox_document(config, name) for name in names])
+
+    for sandbox in new_sandboxes:
+        try:
+            job = await queue_provisioning(sandbox["id"])
+        except HTTPException as exc:
+            created.append({"sandbox_id": sandbox["id"], "job_id": None, "status": "error", "detail": exc.detail})
+            continue
+        created.append({"sandbox_id": sandbox["id"], "job_id": job["id"], "status": sandbox["status"]})
+
+    return {"message": f"{len(created)} sandbox creations started", "sandboxes": created}
+
+@app.get("/api/jobs")
+async def get_jobs_stats():
+    return provisioning_queue.stats()
+
+@app.get("/api/scheduler")
+async def get_scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = provisioning_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.post("/api/sandboxes/{sandbox_id}/start")
 async def start_sandbox(sandbox_id: str):
-    result = sandboxes_collection.update_one(
-        {"id": sandbox_id},
-        {"$set": {"status": "running", "last_accessed": datetime.now().isoformat()}}
-    )
-    if result.matched_count == 0:
+    sandbox = await sandboxes.get(sandbox_id)
+    if not sandbox:
+        raise HTTPException(status_code=404, detail="Sandbox not found")
+    if not scheduler.try_claim(sandbox_id, ResourceScheduler.request_of(sandbox)):
+        raise HTTPException(status_code=503, detail="Not enough host capacity to start the sandbox")
+    await reaper.account([sandbox_id])
+    updated = await sandboxes.update(sandbox_id, lifecycle_fields("start"))
+    if not updated:
+        scheduler.release(sandbox_id)
         raise HTTPException(status_code=404, detail="Sandbox not found")
     return {"message": "Sandbox started"}
 
 @app.post("/api/sandboxes/{sandbox_id}/stop")
 async def stop_sandbox(sandbox_id: str):
-    result = sandboxes_collection.update_one(
-        {"id": sandbox_id},
-        {"$set": {"status": "stopped"}}
-    )
-    if result.matched_count == 0:
+    await reaper.account([sandbox_id])
+    updated = await sandboxes.update(sandbox_id, lifecycle_fields("stop"))
+    if not updated:
         raise HTTPException(status_code=404, detail="Sandbox not found")
     return {"message": "Sandbox stopped"}
 
 @app.post("/api/sandboxes/{sandbox_id}/save")
 async def save_sandbox(sandbox_id: str):
-    result = sandboxes_collection.update_one(
-        {"id": sandbox_id},
-        {"$set": {"status": "saved"}}
-    )
-    if result.matched_count == 0:
+    sandbox = await sandboxes.get(sandbox_id)
+    if not sandbox:
+        raise HTTPException(status_code=404, detail="Sandbox not found")
+    snapshot = await snapshot_engine.create(sandbox)
+    await reaper.account([sandbox_id])
+    updated = await sandboxes.update(sandbox_id, lifecycle_fields("save"))
+    if not updated:
         raise HTTPException(status_code=404, detail="Sandbox not found")
-    return {"message": "Sandbox saved successfully"}
+    return {"message": "Sandbox saved successfully", "snapshot": snapshot_summary(snapshot)}
+
+@app.get("/api/sandboxes/{sandbox_id}/snapshots")
+async def get_sandbox_snapshots(sandbox_id: str):
+    return await snapshot_records.list_for(sandbox_id)
+
+@app.get("/api/snapshots/{snapshot_id}")
+async def get_snapshot(snapshot_id: str):
+    snapshot = await snapshot_records.get(snapshot_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return snapshot_summary(snapshot)
+
+@app.post("/api/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(snapshot_id: str):
+    snapshot = await snapshot_records.get(snapshot_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    sandbox = await sandboxes.get(snapshot["sandbox_id"])
+    if not sandbox:
+        raise HTTPException(status_code=404, detail="Sandbox not found; create a clone from the snapshot instead")
+    if sandbox["status"] in ("running", "creating"):
+        raise HTTPException(status_code=409, detail="Stop or save the sandbox before restoring it")
+    restore_ms = await snapshot_engine.restore(snapshot, sandbox)
+    return {"message": "Sandbox restored", "sandbox_id": sandbox["id"], "restore_ms": restore_ms}
+
+@app.delete("/api/snapshots/{snapshot_id}")
+async def delete_snapshot(snapshot_id: str):
+    if not await snapshot_engine.delete(snapshot_id):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return {"message": "Snapshot deleted"}
 
 @app.delete("/api/sandboxes/{sandbox_id}")
 async def delete_sandbox(sandbox_id: str):
-    result = sandboxes_collection.delete_one({"id": sandbox_id})
-    if result.deleted_count == 0:
+    if history_writer.has_pending(sandbox_id):
+        await history_writer.flush()
+    deleted = await sandboxes.delete(sandbox_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Sandbox not found")
+    await sessions.delete_for([sandbox_id])
+    await shells.delete_for([sandbox_id])
     return {"message": "Sandbox deleted"}
 
-@app.post("/api/terminal/execute")
-async def execute_command(cmd: TerminalCommand):
-    # Get sandbox info
-    sandbox = sandboxes_collection.find_one({"id": cmd.sandbox_id})
-    if not sandbox:
-        raise HTTPException(status_code=404, detail="Sandbox not found")
-    
-    command = cmd.command.strip().lower()
-    
-    # Handle special commands
-    if command.startswith("nmap"):
-        output = "Starting Nmap scan...\nHosts discovered: 192.168.1.1, 192.168.1.100\nOpen ports: 22/tcp, 80/tcp, 443/tcp"
-    elif command.startswith("metasploit") or command == "msfconsole":
-        output = "      =[ metasploit v6.2.23-dev                         ]\n+ -- --=[ 2230 exploits - 1177 auxiliary - 398 post       ]\n+ -- --=[ 867 payloads - 45 encoders - 11 nops            ]\nmsf6 > "
-    elif command.startswith("sqlmap"):
-        output = "sqlmap/1.6.12#stable\n[12:34:56] [INFO] testing connection to target URL\n[12:34:57] [INFO] target appears to be MySQL"
-    elif command.startswith("hashcat"):
-        output = "hashcat (v6.2.5) starting...\nDevice #1: NVIDIA GeForce GTX 1080, 8192 MB"
-    elif command.startswith("john"):
-        output = "John the Ripper 1.9.0-jumbo-1\nLoaded 1 password hash (md5crypt, crypt(3) $1$ [MD5 128/128 AVX 4x3])"
-    elif command.startswith("aircrack-ng"):
-        output = "Aircrack-ng 1.6\nReading packets, please wait...\nOpening wpa.cap\nRead 12345 packets."
-    elif command in COMMAND_RESPONSES:
-        output = COMMAND_RESPONSES[command]
-        if "{id}" in output:
-            output = output.replace("{id}", cmd.sandbox_id[:8])
+def lifecycle_fields(action: str):
+    if action == "start":
+        now = utcnow()
+        return {"status": "running", "last_accessed": now, "uptime_updated_at": now}
+    return {"stop": {"status": "stopped"}, "save": {"status": "saved"}}[action]
+
+BULK_ACTION_CHUNK_SIZE = int(os.environ.get('BULK_ACTION_CHUNK_SIZE', '500'))
+
+@app.post("/api/sandboxes/actions")
+async def bulk_sandbox_action(request: BulkSandboxAction):
+    query = {}
+    if request.ids is not None:
+        query["id"] = {"$in": request.ids}
+    if request.selector is not None:
+        selector = request.selector
+        query.update(sandbox_filters(selector.status, selector.os_type))
+        if selector.created_before is not None:
+            query["created_at"] = {"$lt": selector.created_before}
+    if not query:
+        raise HTTPException(status_code=400, detail="Provide ids or a non-empty selector")
+    query.update(NOT_POOLED)
+
+    refused = {}
+    if request.action == "start":
+        # Only start what the host has room for
+        matched = {}
+        for sandbox in await sandboxes.resources(query):
+            if scheduler.try_claim(sandbox["id"], ResourceScheduler.request_of(sandbox)):
+                matched[sandbox["id"]] = sandbox.get("status")
+            else:
+                refused[sandbox["id"]] = sandbox.get("status")
     else:
-        output = f"bash: {cmd.command}: command not found"
+        matched = await sandboxes.statuses(query)
+    sandbox_ids = list(matched)
+    for start in range(0, len(sandbox_ids), BULK_ACTION_CHUNK_SIZE):
+        chunk = {sandbox_id: matched[sandbox_id] for sandbox_id in sandbox_ids[start:start + BULK_ACTION_CHUNK_SIZE]}
+        if request.action == "delete":
+            if any(history_writer.has_pending(sandbox_id) for sandbox_id in chunk):
+                await history_writer.flush()
+            await sandboxes.delete_many(chunk)
+            await sessions.delete_for(chunk)
+            await shells.delete_for(chunk)
+        else:
+            if request.action == "save":
+                await snapshot_sandboxes(list(chunk))
+            await reaper.account(list(chunk))
+            await sandboxes.update_many(chunk, lifecycle_fields(request.action))
+
+    results = [
+        {"sandbox_id": sandbox_id, "result": "ok", "previous_status": status}
+        for sandbox_id, status in matched.items()
+    ]
+    results.extend(
+        {"sandbox_id": sandbox_id, "result": "insufficient_capacity", "previous_status": status}
+        for sandbox_id, status in refused.items()
+    )
+    for sandbox_id in request.ids or []:
+        if sandbox_id not in matched and sandbox_id not in refused:
+            results.append({"sandbox_id": sandbox_id, "result": "not_found", "previous_status": None})
+    return {"action": request.action, "matched": len(matched) + len(refused), "results": results}
+
+async def run_command(sandbox: dict, command: str):
+    with Timer(dispatch_latency, sandbox["os_type"]):
+        output = await shells.execute(sandbox, command)
     
     # Store command in session history
-    timestamp = datetime.now().isoformat()
+    timestamp = utcnow()
     session_entry = {
-        "sandbox_id": cmd.sandbox_id,
-        "command": cmd.command,
+        "sandbox_id": sandbox["id"],
+        "command": command,
         "output": output,
         "timestamp": timestamp
     }
     
-    sessions_collection.insert_one(session_entry)
+    await history_writer.add(session_entry)
+    reaper.touch(sandbox["id"])
     
     return {
-        "command": cmd.command,
+        "command": command,
         "output": output,
         "timestamp": timestamp,
         "exit_code": 0
     }
 
+@app.post("/api/terminal/execute")
+async def execute_command(cmd: TerminalCommand):
+    # Get sandbox info
+    sandbox = await sandboxes.get(cmd.sandbox_id)
+    if not sandbox:
+        raise HTTPException(status_code=404, detail="Sandbox not found")
+    
+    return await run_command(sandbox, cmd.command)
+
+# Outputs longer than this many lines are streamed line by line over the websocket
+WS_STREAM_MIN_LINES = int(os.environ.get('WS_STREAM_MIN_LINES', '4'))
+# Pause between streamed lines, to mimic a slow terminal; off by default
+WS_STREAM_LINE_DELAY = float(os.environ.get('WS_STREAM_LINE_DELAY', '0'))
+
+@app.websocket("/api/terminal/{sandbox_id}/ws")
+async def terminal_websocket(websocket: WebSocket, sandbox_id: str):
+    await websocket.accept()
+    if not await sandboxes.get(sandbox_id):
+        await websocket.send_json({"type": "error", "detail": "Sandbox not found"})
+        await websocket.close(code=4404)
+        return
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                command = json.loads(message).get("command", "")
+            except (ValueError, AttributeError):
+                command = message
+            if not isinstance(command, str):
+                await websocket.send_json({"type": "error", "detail": "command must be a string"})
+                continue
+            if not command.strip():
+                continue
+
+            sandbox = await sandboxes.get(sandbox_id)
+            if not sandbox:
+                await websocket.send_json({"type": "error", "detail": "Sandbox not found"})
+                await websocket.close(code=4404)
+                return
+
+            try:
+                async with rate_limiter.hold(terminal_limit, rate_limiter.client_of(websocket), sandbox_id):
+                    result = jsonable_encoder(await run_command(sandbox, command))
+            except RateLimited as exc:
+                await websocket.send_json({"type": "error", "detail": str(exc), "retry_after": exc.retry_after})
+                continue
+            lines = result["output"].split("\n")
+            if len(lines) < WS_STREAM_MIN_LINES:
+                await websocket.send_json({"type": "result", **result})
+                continue
+
+            for line in lines:
+                await websocket.send_json({
+                    "type": "output",
+                    "command": result["command"],
+                    "timestamp": result["timestamp"],
+                    "data": line
+                })
+                if WS_STREAM_LINE_DELAY:
+                    await asyncio.sleep(WS_STREAM_LINE_DELAY)
+            await websocket.send_json({"type": "result", **result, "output": None, "streamed": True})
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/api/terminal/{sandbox_id}/history")
-async def get_terminal_history(sandbox_id: str):
-    history = []
-    for doc in sessions_collection.find({"sandbox_id": sandbox_id}).sort("timestamp", 1):
-        doc['_id'] = str(doc['_id'])
-        history.append(doc)
+async def get_terminal_history(
+    sandbox_id: str,
+    response: Response,
+    limit: int = Query(default=500, ge=1, le=1000),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    tail: Optional[int] = Query(default=None, ge=1, le=1000),
+):
+    if before and since:
+        raise HTTPException(status_code=400, detail="Use either before or since, not both")
+    # Make entries still sitting in the write-behind buffer visible
+    if history_writer.has_pending(sandbox_id):
+        await history_writer.flush()
+    try:
+        history, has_more = await sessions.page(
+            sandbox_id,
+            limit=tail or limit,
+            since=since,
+            before=before,
+            newest=tail is not None,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # before=X-Prev-Cursor pages towards older entries, since=X-Next-Cursor
+    # polls for newer ones; X-Has-More is about the direction just read.
+    if history:
+        response.headers["X-Prev-Cursor"] = sessions.cursor_for(history[0])
+        response.headers["X-Next-Cursor"] = sessions.cursor_for(history[-1])
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     return history
 
+@app.get("/api/terminal/{sandbox_id}/history/export")
+async def export_terminal_history(sandbox_id: str):
+    if history_writer.has_pending(sandbox_id):
+        await history_writer.flush()
+
+    async def ndjson():
+        async for entry in sessions.stream(sandbox_id):
+            yield json.dumps(jsonable_encoder(entry)) + "\n"
+
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="history-{sandbox_id}.ndjson"'},
+    )
+
+@app.on_event("shutdown")
+async def close_mongo():
+    client.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
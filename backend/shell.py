@@ -0,0 +1,533 @@
+import asyncio
+import posixpath
+import re
+import shlex
+
+from cache import TTLCache
+
+# Directory nodes are dicts of name -> node, file nodes are strings. Nodes
+# reachable from a base image are never modified: writes copy the
+# directories along the changed path, so every sandbox shares the untouched
+# parts of its image.
+
+
+def lookup(root, parts):
+    node = root
+    for part in parts:
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def assoc(root, parts, value):
+    """Copy of `root` with the node at `parts` set to `value` (removed for None)."""
+    head, rest = parts[0], parts[1:]
+    copy = dict(root)
+    if rest:
+        child = root.get(head)
+        copy[head] = assoc(child if isinstance(child, dict) else {}, rest, value)
+    elif value is None:
+        copy.pop(head, None)
+    else:
+        copy[head] = value
+    return copy
+
+
+def split_path(path):
+    return [part for part in path.split("/") if part]
+
+
+def tree_size(node):
+    if isinstance(node, str):
+        return len(node)
+    return sum(tree_size(child) for child in node.values())
+
+
+class ShellError(Exception):
+    pass
+
+
+class BaseImage:
+    """Read-only filesystem tree and environment an OS template starts from."""
+
+    def __init__(self, root, env, cwd):
+        self.root = root
+        self.env = env
+        self.cwd = cwd
+        self.size = tree_size(root)
+
+
+def build_tree(spec):
+    """Turns {"etc": {"hostname": "x"}} style specs into a tree; None is an empty dir."""
+    if isinstance(spec, str):
+        return spec
+    return {name: {} if child is None else build_tree(child) for name, child in spec.items()}
+
+
+LINUX_ENV = {
+    "HOME": "/root",
+    "USER": "root",
+    "SHELL": "/bin/bash",
+    "TERM": "xterm-256color",
+    "PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+    "LANG": "C.UTF-8",
+}
+
+# Shared by every Linux image, so the images themselves share these subtrees
+LINUX_TREE = build_tree({
+    "bin": {"bash": "", "sh": "", "ls": "", "cat": ""},
+    "boot": None,
+    "dev": {"null": "", "zero": "", "tty": ""},
+    "home": None,
+    "lib": None,
+    "media": None,
+    "mnt": None,
+    "opt": None,
+    "proc": None,
+    "root": {".bashrc": "# ~/.bashrc\nexport PS1='\\u@\\h:\\w\\$ '\n", ".profile": "# ~/.profile\n"},
+    "run": None,
+    "sbin": None,
+    "srv": None,
+    "sys": None,
+    "tmp": None,
+    "usr": {"bin": None, "lib": None, "local": {"bin": None}, "share": None},
+    "var": {"log": None, "tmp": None, "www": None},
+})
+
+
+def linux_image(pretty_name, etc=None, extra=None):
+    root = dict(LINUX_TREE)
+    root["etc"] = build_tree({
+        "hostname": "sandbox\n",
+        "hosts": "127.0.0.1\tlocalhost\n",
+        "passwd": "root:x:0:0:root:/root:/bin/bash\n",
+        "os-release": f'PRETTY_NAME="{pretty_name}"\n',
+        **(etc or {}),
+    })
+    for path, node in (extra or {}).items():
+        root = assoc(root, split_path(path), build_tree(node))
+    return BaseImage(root, LINUX_ENV, "/root")
+
+
+BASE_IMAGES = {
+    "kali": linux_image("Kali GNU/Linux Rolling", extra={
+        "/usr/share/wordlists": {"rockyou.txt": "123456\npassword\n12345678\nqwerty\n"},
+    }),
+    "ubuntu": linux_image("Ubuntu 22.04.3 LTS"),
+    "centos": linux_image("CentOS Stream 9"),
+    "debian": linux_image("Debian GNU/Linux 12 (bookworm)"),
+    "arch": linux_image("Arch Linux"),
+    "windows": BaseImage(
+        build_tree({
+            "Users": {"Administrator": {"Desktop": None, "Documents": None, "Downloads": None}},
+            "Windows": {"System32": {"drivers": {"etc": {"hosts": "127.0.0.1 localhost\n"}}}},
+            "Program Files": None,
+        }),
+        {"USERNAME": "Administrator", "USERPROFILE": "/Users/Administrator", "HOME": "/Users/Administrator", "OS": "Windows_NT"},
+        "/Users/Administrator",
+    ),
+}
+
+
+class ShellState:
+    """One sandbox's shell: its image, copy-on-write tree, cwd and env overrides.
+
+    Changes are queued in `pending` until the engine persists them.
+    """
+
+    __slots__ = ("sandbox_id", "image", "root", "cwd", "env", "pending", "lock")
+
+    def __init__(self, sandbox_id, image):
+        self.sandbox_id = sandbox_id
+        self.image = image
+        self.root = image.root
+        self.cwd = image.cwd
+        self.env = {}
+        self.pending = []
+        self.lock = asyncio.Lock()
+
+    def getenv(self, name):
+        if name == "PWD":
+            return self.cwd
+        if name in self.env:
+            return self.env[name]
+        return self.image.env.get(name)
+
+    def environment(self):
+        merged = {**self.image.env, **self.env, "PWD": self.cwd}
+        return {name: value for name, value in merged.items() if value is not None}
+
+    def resolve(self, path):
+        if path == "~" or path.startswith("~/"):
+            path = (self.getenv("HOME") or "/") + path[1:]
+        return posixpath.normpath(posixpath.join(self.cwd, path)).replace("//", "/")
+
+    def node(self, path):
+        return lookup(self.root, split_path(self.resolve(path)))
+
+    def _set(self, path, value):
+        self.root = assoc(self.root, split_path(path), value)
+
+    def _parent_dir(self, command, path):
+        parent = lookup(self.root, split_path(posixpath.dirname(path)))
+        if not isinstance(parent, dict):
+            raise ShellError(f"{command}: cannot access '{path}': No such file or directory")
+        return parent
+
+    def write_file(self, command, path, content, append=False):
+        path = self.resolve(path)
+        self._parent_dir(command, path)
+        current = lookup(self.root, split_path(path))
+        if isinstance(current, dict) or path == "/":
+            raise ShellError(f"{command}: {path}: Is a directory")
+        if append and current is not None:
+            content = current + content
+        self._set(path, content)
+        self.pending.append(("file", path, content))
+
+    def mkdir(self, path, parents=False):
+        path = self.resolve(path)
+        current = lookup(self.root, split_path(path))
+        if current is not None:
+            if parents and isinstance(current, dict):
+                return
+            raise ShellError(f"mkdir: cannot create directory '{path}': File exists")
+        if parents:
+            ancestor = posixpath.dirname(path)
+            if ancestor != path and lookup(self.root, split_path(ancestor)) is None:
+                self.mkdir(ancestor, parents=True)
+        self._parent_dir("mkdir", path)
+        self._set(path, {})
+        self.pending.append(("dir", path, None))
+
+    def remove(self, command, path, recursive=False, directory_only=False):
+        path = self.resolve(path)
+        current = lookup(self.root, split_path(path))
+        if current is None:
+            raise ShellError(f"{command}: cannot remove '{path}': No such file or directory")
+        if path == "/":
+            raise ShellError(f"{command}: it is dangerous to operate recursively on '/'")
+        if isinstance(current, dict):
+            if directory_only and current:
+                raise ShellError(f"{command}: failed to remove '{path}': Directory not empty")
+            if not recursive and not directory_only:
+                raise ShellError(f"{command}: cannot remove '{path}': Is a directory")
+        elif directory_only:
+            raise ShellError(f"{command}: failed to remove '{path}': Not a directory")
+        self._set(path, None)
+        self.pending.append(("delete", path, None))
+
+    def chdir(self, path):
+        target = self.resolve(path)
+        node = lookup(self.root, split_path(target))
+        if node is None:
+            raise ShellError(f"cd: {path}: No such file or directory")
+        if not isinstance(node, dict):
+            raise ShellError(f"cd: {path}: Not a directory")
+        self.cwd = target
+        self.pending.append(("cwd", target, None))
+
+    def setenv(self, name, value):
+        self.env[name] = value
+        self.pending.append(("env", name, value))
+
+    def apply(self, kind, path, content):
+        """Replays a persisted change without queueing it again."""
+        if kind == "file":
+            self.root = assoc(self.root, split_path(path), content)
+        elif kind == "dir":
+            self.root = assoc(self.root, split_path(path), {})
+        elif kind == "deleted":
+            self.root = assoc(self.root, split_path(path), None)
+
+    def usage(self):
+        return tree_size(self.root)
+
+
+VARIABLE = re.compile(r"\$(\w+)|\$\{(\w+)\}")
+
+
+def expand(state, raw):
+    """Replaces $NAME and ${NAME} outside single quotes."""
+    parts = re.split(r"('[^']*')", raw)
+    for index in range(0, len(parts), 2):
+        parts[index] = VARIABLE.sub(lambda match: state.getenv(match.group(1) or match.group(2)) or "", parts[index])
+    return "".join(parts)
+
+
+def split_redirect(raw):
+    """The command without its trailing > / >> redirect, the target and whether to append."""
+    quote = None
+    escaped = False
+    for index, char in enumerate(raw):
+        if escaped:
+            escaped = False
+        elif char == "\\" and quote != "'":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == ">":
+            # Unquoted, so it is a redirect even inside a word, as in `echo a>b`
+            append = raw.startswith(">>", index)
+            try:
+                command = shlex.split(raw[:index])
+                target = shlex.split(raw[index + 1 + append:])
+            except ValueError:
+                return raw, None, False
+            if not target:
+                return raw, None, False
+            return shlex.join(command), target[0], append
+    return raw, None, False
+
+
+class ShellEngine:
+    """Stateful shells for every sandbox, on top of the command dispatcher.
+
+    Shells are loaded from `repository` the first time a sandbox runs a
+    command and kept in an LRU of `cache_size` states. Every command that
+    changes a shell has its changes written before it returns, so an
+    evicted state can always be reloaded from Mongo.
+    """
+
+    def __init__(self, repository, dispatcher, images=BASE_IMAGES, cache_size=5000, ttl=3600):
+        self.repository = repository
+        self.dispatcher = dispatcher
+        self.images = images
+        self.states = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._loading = {}
+
+    def image(self, os_type):
+        return self.images.get(os_type) or self.images["ubuntu"]
+
+    async def state(self, sandbox):
+        state = self.states.get(sandbox["id"])
+        if state is not None:
+            return state
+        loading = self._loading.get(sandbox["id"])
+        if loading is None:
+            loading = self._loading[sandbox["id"]] = asyncio.ensure_future(self._load(sandbox))
+            loading.add_done_callback(lambda _: self._loading.pop(sandbox["id"], None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, sandbox):
+        state = ShellState(sandbox["id"], self.image(sandbox["os_type"]))
+        stored, files = await self.repository.load(sandbox["id"])
+        if stored is not None:
+            state.cwd = stored.get("cwd") or state.cwd
+            state.env = dict(stored.get("env") or {})
+        # Parents before children, so a recreated directory starts out empty
+        for change in sorted(files, key=lambda change: change["path"].count("/")):
+            state.apply(change["kind"], change["path"], change.get("content"))
+        self.states.set(sandbox["id"], state)
+        return state
+
+    async def save(self, state):
+        async with state.lock:
+            pending, state.pending = state.pending, []
+            if pending:
+                await self.repository.save(state.sandbox_id, pending)
+
+    async def execute(self, sandbox, raw):
+        state = await self.state(sandbox)
+        command, target, append = split_redirect(expand(state, raw.strip()))
+        try:
+            output = self.dispatcher.dispatch(sandbox["id"], sandbox["os_type"], command, shell=state, sandbox=sandbox)
+            if target is not None:
+                state.write_file("bash", target, output + "\n" if output else "", append=append)
+                output = ""
+        except ShellError as exc:
+            output = str(exc)
+        await self.save(state)
+        return output
+
+    async def _stored(self, sandbox_id):
+        state = self.states.peek(sandbox_id)
+        if state is not None:
+            await self.save(state)
+        return await self.repository.load(sandbox_id)
+
+    async def capture_environment(self, sandbox):
+        stored, _ = await self._stored(sandbox["id"])
+        return {"cwd": (stored or {}).get("cwd"), "env": (stored or {}).get("env") or {}}
+
+    async def capture_files(self, sandbox):
+        """The sandbox's changes to its image, by path."""
+        _, files = await self._stored(sandbox["id"])
+        return {change["path"]: {"kind": change["kind"], "content": change.get("content")} for change in files}
+
+    async def restore_environment(self, sandbox_id, environment):
+        self.states.invalidate(sandbox_id)
+        await self.repository.set_environment(sandbox_id, environment.get("cwd"), environment.get("env") or {})
+
+    async def restore_files(self, sandbox_id, files):
+        self.states.invalidate(sandbox_id)
+        await self.repository.replace_files(sandbox_id, [{"path": path, **change} for path, change in files.items()])
+
+    async def delete_for(self, sandbox_ids):
+        for sandbox_id in sandbox_ids:
+            self.states.invalidate(sandbox_id)
+        await self.repository.delete_for(sandbox_ids)
+
+    def stats(self):
+        return {"images": len(self.images), "loading": len(self._loading), **self.states.stats()}
+
+
+def split_flags(args):
+    flags = set()
+    paths = []
+    for arg in args:
+        if arg.startswith("-") and len(arg) > 1:
+            flags.update(arg[1:])
+        else:
+            paths.append(arg)
+    return flags, paths
+
+
+def ls(shell, ctx):
+    flags, paths = split_flags(ctx.args)
+    outputs = []
+    for path in paths or ["."]:
+        node = shell.node(path)
+        if node is None:
+            outputs.append(f"ls: cannot access '{path}': No such file or directory")
+            continue
+        if isinstance(node, str):
+            names = {path: node}
+        else:
+            names = {name: child for name, child in node.items() if "a" in flags or not name.startswith(".")}
+            if "a" in flags:
+                names = {".": node, "..": {}, **names}
+        if "l" in flags:
+            lines = [f"total {len(names) * 4}"] if isinstance(node, dict) else []
+            for name, child in sorted(names.items()):
+                if isinstance(child, dict):
+                    lines.append(f"drwxr-xr-x 2 root root {4096:>6} Oct 17 12:00 {name}")
+                else:
+                    lines.append(f"-rw-r--r-- 1 root root {len(child):>6} Oct 17 12:00 {name}")
+            listing = "\n".join(lines)
+        else:
+            listing = "  ".join(sorted(names))
+        outputs.append(f"{path}:\n{listing}" if len(paths) > 1 else listing)
+    return "\n\n".join(outputs)
+
+
+def cat(shell, ctx):
+    outputs = []
+    for path in ctx.args:
+        node = shell.node(path)
+        if node is None:
+            outputs.append(f"cat: {path}: No such file or directory\n")
+        elif isinstance(node, dict):
+            outputs.append(f"cat: {path}: Is a directory\n")
+        else:
+            outputs.append(node)
+    return "".join(outputs).rstrip("\n")
+
+
+def touch(shell, ctx):
+    for path in ctx.args:
+        if shell.node(path) is None:
+            shell.write_file("touch", path, "")
+    return ""
+
+
+def mkdir(shell, ctx):
+    flags, paths = split_flags(ctx.args)
+    if not paths:
+        return "mkdir: missing operand"
+    errors = []
+    for path in paths:
+        try:
+            shell.mkdir(path, parents="p" in flags)
+        except ShellError as exc:
+            errors.append(str(exc))
+    return "\n".join(errors)
+
+
+def rm(shell, ctx):
+    flags, paths = split_flags(ctx.args)
+    if not paths:
+        return "rm: missing operand"
+    errors = []
+    for path in paths:
+        try:
+            shell.remove("rm", path, recursive=bool(flags & {"r", "R"}))
+        except ShellError as exc:
+            if "f" not in flags or "No such file" not in str(exc):
+                errors.append(str(exc))
+    return "\n".join(errors)
+
+
+def rmdir(shell, ctx):
+    errors = []
+    for path in ctx.args:
+        try:
+            shell.remove("rmdir", path, directory_only=True)
+        except ShellError as exc:
+            errors.append(str(exc))
+    return "\n".join(errors)
+
+
+def cd(shell, ctx):
+    shell.chdir(ctx.args[0] if ctx.args else "~")
+    return ""
+
+
+def pwd(shell, ctx):
+    return shell.cwd
+
+
+ENV_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def export(shell, ctx):
+    if not ctx.args:
+        return "\n".join(f'declare -x {name}="{value}"' for name, value in sorted(shell.environment().items()))
+    for arg in ctx.args:
+        name, _, value = arg.partition("=")
+        if not ENV_NAME.match(name):
+            return f"bash: export: `{arg}': not a valid identifier"
+        shell.setenv(name, value)
+    return ""
+
+
+def unset(shell, ctx):
+    for name in ctx.args:
+        if ENV_NAME.match(name):
+            shell.setenv(name, None)
+    return ""
+
+
+def env(shell, ctx):
+    return "\n".join(f"{name}={value}" for name, value in sorted(shell.environment().items()))
+
+
+def df(shell, ctx):
+    size_gb = (ctx.sandbox or {}).get("disk_gb") or 20
+    # The image stands in for a typical base install's footprint
+    used_gb = 2.1 + shell.usage() / 2**30
+    available_gb = max(size_gb - used_gb, 0)
+    return (
+        "Filesystem      Size  Used Avail Use% Mounted on\n"
+        f"/dev/sda1       {size_gb:>3}G  {used_gb:.1f}G  {available_gb:>3.0f}G  {used_gb / size_gb:>3.0%} /"
+    )
+
+
+SHELL_COMMANDS = {
+    "ls": ls,
+    "cat": cat,
+    "touch": touch,
+    "mkdir": mkdir,
+    "rm": rm,
+    "rmdir": rmdir,
+    "cd": cd,
+    "pwd": pwd,
+    "export": export,
+    "unset": unset,
+    "env": env,
+    "df": df,
+}
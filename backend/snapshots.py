@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from cache import TTLCache
+
+
+class ChunkStore:
+    """Content-addressed chunk files on local disk.
+
+    Data is split into `chunk_size` pieces, each stored once, zlib-compressed,
+    under its SHA-256. Methods do blocking file IO; call them from a thread.
+    """
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(os.path.join(root, "chunks"), exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, "chunks", digest[:2], digest)
+
+    def put(self, data):
+        """Stores `data`; returns its chunk digests and the bytes newly written."""
+        digests = []
+        written = 0
+        for start in range(0, max(len(data), 1), self.chunk_size):
+            piece = data[start:start + self.chunk_size]
+            digest = hashlib.sha256(piece).hexdigest()
+            digests.append(digest)
+            path = self._path(digest)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zlib.compress(piece)
+            temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(compressed)
+            os.replace(temporary, path)
+            written += len(compressed)
+        return digests, written
+
+    def get(self, digests):
+        parts = []
+        for digest in digests:
+            with open(self._path(digest), "rb") as f:
+                parts.append(zlib.decompress(f.read()))
+        return b"".join(parts)
+
+    def collect(self, live):
+        """Deletes every chunk whose digest is not in `live`; returns how many."""
+        removed = 0
+        chunks = os.path.join(self.root, "chunks")
+        for prefix in os.listdir(chunks):
+            directory = os.path.join(chunks, prefix)
+            for name in os.listdir(directory):
+                if name.endswith(".tmp") or name in live:
+                    continue
+                os.remove(os.path.join(directory, name))
+                removed += 1
+        return removed
+
+    def usage(self):
+        chunks = 0
+        size = 0
+        for directory, _, names in os.walk(os.path.join(self.root, "chunks")):
+            for name in names:
+                chunks += 1
+                size += os.path.getsize(os.path.join(directory, name))
+        return {"chunks": chunks, "bytes": size}
+
+
+class SnapshotEngine:
+    """Captures and restores sandbox state through registered sections.
+
+    Each section has a `capture(sandbox)` coroutine returning JSON-able
+    state and an optional `restore(sandbox, state, clone)` coroutine applying it,
+    either to the sandbox it was taken from or (with `clone` set) to a new
+    sandbox created from the snapshot. Sections registered with `split`
+    hold a dict whose values are stored as separate entries, so unchanged
+    values (e.g. files) are shared between snapshots chunk for chunk.
+    Snapshot records live in `repository`, chunks in `store`.
+    """
+
+    def __init__(self, store, repository, cache_size=32):
+        self.store = store
+        self.repository = repository
+        self.sections = OrderedDict()
+        self.restores = 0
+        self.restore_seconds = 0.0
+        self._states = TTLCache(maxsize=cache_size, ttl=3600)
+        self._lock = asyncio.Lock()
+
+    def register(self, name, capture, restore, split=False):
+        self.sections[name] = (capture, restore, split)
+
+    @staticmethod
+    def _encode(value):
+        return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+
+    def _write(self, state):
+        # A list rather than a dict: entry names may contain "." or "$"
+        entries = []
+        size = 0
+        written = 0
+        for name, value in state.items():
+            items = [(name, value)]
+            if self.sections[name][2]:
+                items = [(f"{name}/{key}", item) for key, item in value.items()]
+                entries.append({"name": name, "chunks": None})
+            for entry, item in items:
+                data = self._encode(item)
+                chunks, new_bytes = self.store.put(data)
+                entries.append({"name": entry, "chunks": chunks})
+                size += len(data)
+                written += new_bytes
+        return entries, size, written
+
+    def _read(self, snapshot):
+        state = {}
+        for entry in snapshot["entries"]:
+            if entry["chunks"] is None:
+                state.setdefault(entry["name"], {})
+                continue
+            section, _, key = entry["name"].partition("/")
+            value = json.loads(self.store.get(entry["chunks"]))
+            if key:
+                state.setdefault(section, {})[key] = value
+            else:
+                state[section] = value
+        return state
+
+    async def create(self, sandbox, name=None):
+        started = time.perf_counter()
+        state = {section: await capture(sandbox) for section, (capture, _, _) in self.sections.items()}
+        async with self._lock:
+            entries, size, written = await asyncio.to_thread(self._write, state)
+            snapshot = {
+                "id": str(uuid.uuid4()),
+                "sandbox_id": sandbox["id"],
+                "name": name or f"{sandbox['name']} {datetime.now(timezone.utc):%Y-%m-%d %H:%M:%S}",
+                "os_type": sandbox["os_type"],
+                "created_at": datetime.now(timezone.utc),
+                "entries": entries,
+                "size": size,
+                "stored_size": written,
+                "capture_ms": round((time.perf_counter() - started) * 1000, 3),
+                "restore_ms": None,
+            }
+            await self.repository.insert(snapshot)
+        self._states.set(snapshot["id"], state)
+        return snapshot
+
+    async def load(self, snapshot):
+        state = self._states.get(snapshot["id"])
+        if state is None:
+            state = await asyncio.to_thread(self._read, snapshot)
+            self._states.set(snapshot["id"], state)
+        return state
+
+    async def restore(self, snapshot, sandbox, clone=False):
+        """Applies a snapshot to `sandbox`; returns the time taken in ms."""
+        started = time.perf_counter()
+        state = await self.load(snapshot)
+        for section, (_, restore, _) in self.sections.items():
+            if restore is not None and section in state:
+                await restore(sandbox, state[section], clone)
+        elapsed = round((time.perf_counter() - started) * 1000, 3)
+        self.restores += 1
+        self.restore_seconds += elapsed / 1000
+        await self.repository.record_restore(snapshot["id"], elapsed)
+        return elapsed
+
+    async def delete(self, snapshot_id):
+        async with self._lock:
+            deleted = await self.repository.delete(snapshot_id)
+            if deleted:
+                self._states.invalidate(snapshot_id)
+                live = await self.repository.live_chunks()
+                await asyncio.to_thread(self.store.collect, live)
+        return deleted
+
+    async def stats(self):
+        usage = await asyncio.to_thread(self.store.usage)
+        return {
+            "snapshots": await self.repository.count(),
+            "chunks": usage["chunks"],
+            "stored_bytes": usage["bytes"],
+            "restores": self.restores,
+            "avg_restore_ms": round(self.restore_seconds / self.restores * 1000, 3) if self.restores else None,
+        }
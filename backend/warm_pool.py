@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import Counter
+
+logger = logging.getLogger("trolixve.warm_pool")
+
+
+def parse_sizes(value):
+    """Parses "kali:3,ubuntu:2" into {"kali": 3, "ubuntu": 2}."""
+    sizes = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        os_type, _, size = item.partition(":")
+        sizes[os_type.strip()] = int(size or 1)
+    return sizes
+
+
+class WarmPool:
+    """Pre-provisioned sandboxes kept ready per OS template.
+
+    `sizes` maps an os_type to how many sandboxes with the `spec` resources
+    to keep in the "warm" state. `take` hands the oldest one out with a
+    single update; `fill` (a coroutine taking an os_type and a count)
+    creates replacements, which a background task requests whenever a
+    sandbox is taken and every `interval` seconds.
+    """
+
+    def __init__(self, repository, scheduler, fill, sizes, spec, interval=5.0):
+        self.repository = repository
+        self.scheduler = scheduler
+        self.fill = fill
+        self.sizes = sizes
+        self.spec = spec
+        self.interval = interval
+        self.hits = Counter()
+        self.misses = Counter()
+        self.filled = Counter()
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def matches(self, os_type, request):
+        return os_type in self.sizes and all(request[resource] == self.spec[resource] for resource in self.spec)
+
+    async def take(self, os_type, request, fields):
+        """A warm sandbox relabelled with `fields`, or None to create one cold."""
+        if not self.matches(os_type, request):
+            if os_type in self.sizes:
+                self.misses[os_type] += 1
+            return None
+        sandbox = await self.repository.claim_pooled(os_type, fields)
+        if sandbox is not None and not self.scheduler.try_claim(sandbox["id"], request):
+            await self.repository.return_to_pool(sandbox["id"])
+            sandbox = None
+        if sandbox is None:
+            self.misses[os_type] += 1
+            return None
+        self.repository.announce(sandbox)
+        self.hits[os_type] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return sandbox
+
+    async def refill(self):
+        counts = await self.repository.pooled_counts()
+        for os_type, size in self.sizes.items():
+            missing = size - counts.get(os_type, 0)
+            if missing > 0:
+                await self.fill(os_type, missing)
+                self.filled[os_type] += missing
+
+    def stats(self):
+        pools = {}
+        for os_type, size in self.sizes.items():
+            requests = self.hits[os_type] + self.misses[os_type]
+            pools[os_type] = {
+                "size": size,
+                "hits": self.hits[os_type],
+                "misses": self.misses[os_type],
+                "hit_rate": round(self.hits[os_type] / requests, 4) if requests else 0.0,
+                "filled": self.filled[os_type],
+            }
+        return {"spec": self.spec, "interval": self.interval, "pools": pools}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Warm pool refill failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,192 @@
+"""Offline load benchmark for the TrolixVE API.
+
+Boots backend/server.py in-process behind httpx's ASGI transport, backed by
+an in-memory mongomock database, drives a concurrent mixed workload and
+reports latency percentiles and throughput per endpoint.
+
+    python backend_benchmark.py --requests 2000 --concurrency 50
+    python backend_benchmark.py --save-baseline
+    python backend_benchmark.py --compare
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from tests.support import IN_PROCESS_ENV, load_server
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend_benchmark_baseline.json")
+
+# Relative weights of each operation in the mixed workload
+WORKLOAD = {
+    "list": 30,
+    "create": 10,
+    "execute": 40,
+    "history": 20,
+}
+
+# Run parameters a baseline is only comparable under
+RUN_PARAMETERS = ("requests", "concurrency", "sandboxes")
+
+COMMANDS = ["ls", "pwd", "whoami", "uname -a", "ps aux", "nmap -sV 10.0.0.1", "help", "foo"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_benchmark(total_requests, concurrency, sandbox_count, seed):
+    import httpx
+
+    server = load_server(IN_PROCESS_ENV)
+    app = server.app
+    rng = random.Random(seed)
+    operations = list(WORKLOAD)
+    weights = [WORKLOAD[operation] for operation in operations]
+    latencies = {}
+    errors = {}
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            response = await client.post("/api/sandboxes/bulk", json={
+                "config": {"name": "bench", "os_type": "kali"},
+                "count": min(sandbox_count, 100),
+            })
+            response.raise_for_status()
+            sandbox_ids = [entry["sandbox_id"] for entry in response.json()["sandboxes"]]
+
+            async def request(operation):
+                sandbox_id = rng.choice(sandbox_ids)
+                if operation == "list":
+                    return "GET /api/sandboxes", client.get("/api/sandboxes", params={"limit": 50})
+                if operation == "create":
+                    return "POST /api/sandboxes", client.post(
+                        "/api/sandboxes", json={"name": "bench", "os_type": rng.choice(["kali", "ubuntu"])}
+                    )
+                if operation == "execute":
+                    return "POST /api/terminal/execute", client.post(
+                        "/api/terminal/execute", json={"sandbox_id": sandbox_id, "command": rng.choice(COMMANDS)}
+                    )
+                return "GET /api/terminal/{id}/history", client.get(
+                    f"/api/terminal/{sandbox_id}/history", params={"tail": 100}
+                )
+
+            remaining = [total_requests]
+
+            async def worker():
+                while remaining[0] > 0:
+                    remaining[0] -= 1
+                    endpoint, pending = await request(rng.choices(operations, weights)[0])
+                    started = time.perf_counter()
+                    response = await pending
+                    elapsed = time.perf_counter() - started
+                    latencies.setdefault(endpoint, []).append(elapsed)
+                    if response.status_code >= 400:
+                        errors[endpoint] = errors.get(endpoint, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            duration = time.perf_counter() - started
+    finally:
+        await app.router.shutdown()
+
+    report = {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "sandboxes": len(sandbox_ids),
+        "duration_s": round(duration, 3),
+        "requests_per_s": round(total_requests / duration, 1),
+        "endpoints": {},
+    }
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        report["endpoints"][endpoint] = {
+            "count": len(values),
+            "errors": errors.get(endpoint, 0),
+            "requests_per_s": round(len(values) / duration, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n📊 {report['requests']} requests, concurrency {report['concurrency']}: "
+          f"{report['requests_per_s']} req/s over {report['duration_s']}s")
+    print(f"{'endpoint':<34}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<34}{stats['count']:>7}{stats['errors']:>8}{stats['requests_per_s']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def parameter_mismatches(parameters, baseline):
+    """The run parameters that differ from the ones the baseline was recorded with."""
+    return [
+        f"{name}={parameters[name]} (baseline: {baseline.get(name, 'not recorded')})"
+        for name in RUN_PARAMETERS
+        if baseline.get(name) != parameters[name]
+    ]
+
+
+def compare(report, baseline, tolerance):
+    """Prints p95 changes against the baseline; returns False on a regression."""
+    ok = True
+    print(f"\n🔍 Comparing p95 latency with baseline (tolerance {tolerance:.0%})...")
+    for endpoint, stats in report["endpoints"].items():
+        previous = baseline["endpoints"].get(endpoint)
+        if not previous or not previous["p95_ms"]:
+            print(f"  {endpoint}: no baseline")
+            continue
+        change = stats["p95_ms"] / previous["p95_ms"] - 1
+        regressed = change > tolerance
+        ok = ok and not regressed
+        print(f"  {'❌' if regressed else '✅'} {endpoint}: {previous['p95_ms']} -> {stats['p95_ms']} ms ({change:+.0%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sandboxes", type=int, default=50, help="sandboxes created before the run (max 100)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="fail if p95 regresses past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.compare and not args.save_baseline:
+        if not os.path.exists(args.baseline):
+            parser.error(f"no baseline at {args.baseline}; record one with --save-baseline first")
+        with open(args.baseline) as f:
+            mismatches = parameter_mismatches(
+                {"requests": args.requests, "concurrency": args.concurrency, "sandboxes": min(args.sandboxes, 100)},
+                json.load(f),
+            )
+        if mismatches:
+            parser.error(f"the baseline at {args.baseline} was recorded with other parameters: {', '.join(mismatches)}")
+
+    report = asyncio.run(run_benchmark(args.requests, args.concurrency, args.sandboxes, args.seed))
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.exit(0 if compare(report, baseline, args.tolerance) else 1)
+
+
+if __name__ == "__main__":
+    main()
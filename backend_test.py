@@ -169,7 +169,7 @@ class TrolixVEAPITester(unittest.TestCase):
         # Test basic command
         command_data = {
             "sandbox_id": self.sandbox_id,
-            "command": "ls"
+            "command": "ls /"
         }
         response = requests.post(
             f"{self.base_url}/api/terminal/execute",
@@ -177,7 +177,7 @@ class TrolixVEAPITester(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
         result = response.json()
-        self.assertEqual(result["command"], "ls")
+        self.assertEqual(result["command"], "ls /")
         self.assertIn("bin", result["output"])
         print("✅ Basic terminal command execution passed")
         
@@ -262,6 +262,246 @@ class TrolixVEAPITester(unittest.TestCase):
         
         print("✅ Error handling tests passed")
 
+    def test_13_provisioning_job(self):
+        """Test that sandbox creation returns immediately and completes in the background"""
+        print("\n🔍 Testing background provisioning job...")
+        # Resources the warm pool does not hold, so the sandbox is created cold
+        config = {
+            "name": f"{self.test_sandbox_name}-job",
+            "os_type": "ubuntu",
+            "cpu_cores": 1
+        }
+        start = time.time()
+        response = requests.post(f"{self.base_url}/api/sandboxes", json=config)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.time() - start, 1.5)
+        data = response.json()
+        self.assertEqual(data["status"], "creating")
+        self.assertIn("job_id", data)
+
+        job = None
+        for _ in range(10):
+            response = requests.get(f"{self.base_url}/api/jobs/{data['job_id']}")
+            self.assertEqual(response.status_code, 200)
+            job = response.json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(1)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["sandbox_id"], data["sandbox_id"])
+
+        requests.delete(f"{self.base_url}/api/sandboxes/{data['sandbox_id']}")
+        print("✅ Background provisioning job passed")
+
+    def test_14_bulk_create_sandboxes(self):
+        """Test creating several sandboxes in one request"""
+        print("\n🔍 Testing bulk create sandboxes endpoint...")
+        payload = {
+            "config": {"name": f"{self.test_sandbox_name}-bulk", "os_type": "kali"},
+            "count": 3
+        }
+        response = requests.post(f"{self.base_url}/api/sandboxes/bulk", json=payload)
+        self.assertEqual(response.status_code, 200)
+        created = response.json()["sandboxes"]
+        self.assertEqual(len(created), 3)
+        for entry in created:
+            self.assertIn("job_id", entry)
+            requests.delete(f"{self.base_url}/api/sandboxes/{entry['sandbox_id']}")
+
+        response = requests.get(f"{self.base_url}/api/jobs/nonexistent-job")
+        self.assertEqual(response.status_code, 404)
+        print("✅ Bulk create sandboxes endpoint passed")
+
+    def test_15_sandboxes_pagination(self):
+        """Test keyset pagination, filters and projection on the sandbox list"""
+        print("\n🔍 Testing sandbox list pagination...")
+        response = requests.get(f"{self.base_url}/api/sandboxes", params={"limit": 1, "fields": "name,status"})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertLessEqual(len(page), 1)
+        for sandbox in page:
+            self.assertNotIn("cpu_cores", sandbox)
+            self.assertIn("name", sandbox)
+
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor:
+            response = requests.get(f"{self.base_url}/api/sandboxes", params={"limit": 1, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.json()[0]["id"], page[0]["id"])
+
+        response = requests.get(f"{self.base_url}/api/sandboxes", params={"status": "running"})
+        self.assertEqual(response.status_code, 200)
+        for sandbox in response.json():
+            self.assertEqual(sandbox["status"], "running")
+
+        response = requests.get(f"{self.base_url}/api/sandboxes", params={"fields": "not_a_field"})
+        self.assertEqual(response.status_code, 400)
+
+        response = requests.get(f"{self.base_url}/api/sandboxes/summary")
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual(summary["total"], sum(summary["by_status"].values()))
+        print("✅ Sandbox list pagination passed")
+
+    def test_16_terminal_history_pagination(self):
+        """Test tail, cursor paging and NDJSON export of terminal history"""
+        print("\n🔍 Testing terminal history pagination...")
+        response = requests.post(f"{self.base_url}/api/sandboxes", json={"name": f"{self.test_sandbox_name}-history", "os_type": "kali"})
+        sandbox_id = response.json()["sandbox_id"]
+        for command in ["ls", "pwd", "whoami"]:
+            requests.post(f"{self.base_url}/api/terminal/execute", json={"sandbox_id": sandbox_id, "command": command})
+
+        response = requests.get(f"{self.base_url}/api/terminal/{sandbox_id}/history", params={"tail": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry["command"] for entry in response.json()], ["pwd", "whoami"])
+        self.assertEqual(response.headers["X-Has-More"], "true")
+
+        response = requests.get(
+            f"{self.base_url}/api/terminal/{sandbox_id}/history",
+            params={"before": response.headers["X-Prev-Cursor"]}
+        )
+        self.assertEqual([entry["command"] for entry in response.json()], ["ls"])
+
+        response = requests.get(f"{self.base_url}/api/terminal/{sandbox_id}/history/export")
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(lines), 3)
+
+        requests.delete(f"{self.base_url}/api/sandboxes/{sandbox_id}")
+        print("✅ Terminal history pagination passed")
+
+    def test_17_bulk_sandbox_actions(self):
+        """Test fleet-wide lifecycle actions by ids"""
+        print("\n🔍 Testing bulk sandbox actions...")
+        payload = {
+            "config": {"name": f"{self.test_sandbox_name}-fleet", "os_type": "ubuntu"},
+            "count": 3
+        }
+        response = requests.post(f"{self.base_url}/api/sandboxes/bulk", json=payload)
+        ids = [entry["sandbox_id"] for entry in response.json()["sandboxes"]]
+
+        response = requests.post(f"{self.base_url}/api/sandboxes/actions", json={"action": "stop", "ids": ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["matched"], 3)
+
+        response = requests.post(
+            f"{self.base_url}/api/sandboxes/actions",
+            json={"action": "delete", "ids": ids + ["nonexistent-id-12345"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        results = {entry["sandbox_id"]: entry["result"] for entry in response.json()["results"]}
+        self.assertEqual(results["nonexistent-id-12345"], "not_found")
+        for sandbox_id in ids:
+            self.assertEqual(results[sandbox_id], "ok")
+
+        response = requests.post(f"{self.base_url}/api/sandboxes/actions", json={"action": "stop"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Bulk sandbox actions passed")
+
+    def test_18_warm_pool_hit(self):
+        """Test that a creation matching the warm pool is served from it, already running"""
+        print("\n🔍 Testing warm pool hit...")
+        response = requests.get(f"{self.base_url}/api/health/warm-pool")
+        self.assertEqual(response.status_code, 200)
+        hits = response.json()["pools"]["ubuntu"]["hits"]
+
+        # The pool fills in the background; wait for a ready sandbox
+        data = None
+        for _ in range(15):
+            response = requests.post(f"{self.base_url}/api/sandboxes", json={"name": f"{self.test_sandbox_name}-warm", "os_type": "ubuntu"})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            if data["job_id"] is None:
+                break
+            requests.delete(f"{self.base_url}/api/sandboxes/{data['sandbox_id']}")
+            time.sleep(1)
+        self.assertEqual(data["status"], "running")
+        self.assertIsNone(data["job_id"])
+
+        response = requests.get(f"{self.base_url}/api/sandboxes", params={"status": "running"})
+        self.assertIn(data["sandbox_id"], [sandbox["id"] for sandbox in response.json()])
+        response = requests.get(f"{self.base_url}/api/health/warm-pool")
+        pool = response.json()["pools"]["ubuntu"]
+        self.assertEqual(pool["hits"], hits + 1)
+        self.assertGreater(pool["hit_rate"], 0)
+
+        requests.delete(f"{self.base_url}/api/sandboxes/{data['sandbox_id']}")
+        print("✅ Warm pool hit passed")
+
+    def wait_for_job(self, job_id):
+        job = None
+        for _ in range(10):
+            job = requests.get(f"{self.base_url}/api/jobs/{job_id}").json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(1)
+        self.assertEqual(job["status"], "completed")
+
+    def execute(self, sandbox_id, command):
+        response = requests.post(f"{self.base_url}/api/terminal/execute", json={"sandbox_id": sandbox_id, "command": command})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["output"]
+
+    def test_19_sandbox_snapshots(self):
+        """Test saving, restoring, cloning and deleting sandbox snapshots"""
+        print("\n🔍 Testing sandbox snapshots...")
+        config = {"name": f"{self.test_sandbox_name}-snapshot", "os_type": "kali", "cpu_cores": 1}
+        data = requests.post(f"{self.base_url}/api/sandboxes", json=config).json()
+        sandbox_id = data["sandbox_id"]
+        self.wait_for_job(data["job_id"])
+        self.execute(sandbox_id, "echo saved > /root/notes.txt")
+        self.execute(sandbox_id, "export STAGE=saved")
+        self.execute(sandbox_id, "cd /tmp")
+
+        # Saving takes a snapshot
+        response = requests.post(f"{self.base_url}/api/sandboxes/{sandbox_id}/save")
+        self.assertEqual(response.status_code, 200)
+        snapshot = response.json()["snapshot"]
+        self.assertEqual(snapshot["sandbox_id"], sandbox_id)
+        self.assertNotIn("entries", snapshot)
+        response = requests.get(f"{self.base_url}/api/sandboxes/{sandbox_id}/snapshots")
+        self.assertIn(snapshot["id"], [entry["id"] for entry in response.json()])
+
+        # A running sandbox cannot be restored
+        requests.post(f"{self.base_url}/api/sandboxes/{sandbox_id}/start")
+        response = requests.post(f"{self.base_url}/api/snapshots/{snapshot['id']}/restore")
+        self.assertEqual(response.status_code, 409)
+
+        # Restoring a stopped sandbox rolls its files back
+        self.execute(sandbox_id, "rm /root/notes.txt")
+        requests.post(f"{self.base_url}/api/sandboxes/{sandbox_id}/stop")
+        response = requests.post(f"{self.base_url}/api/snapshots/{snapshot['id']}/restore")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.execute(sandbox_id, "cat /root/notes.txt"), "saved")
+
+        # A clone starts with the snapshot's files, environment and directory
+        clone = requests.post(
+            f"{self.base_url}/api/sandboxes",
+            json={"name": f"{self.test_sandbox_name}-clone", "os_type": "ubuntu", "snapshot_id": snapshot["id"]}
+        ).json()
+        self.wait_for_job(clone["job_id"])
+        self.assertEqual(self.execute(clone["sandbox_id"], "cat /root/notes.txt"), "saved")
+        self.assertEqual(self.execute(clone["sandbox_id"], "echo $STAGE"), "saved")
+        self.assertEqual(self.execute(clone["sandbox_id"], "pwd"), "/tmp")
+        response = requests.get(f"{self.base_url}/api/sandboxes", params={"fields": "id,os_type,cloned_from"})
+        cloned = next(sandbox for sandbox in response.json() if sandbox["id"] == clone["sandbox_id"])
+        self.assertEqual((cloned["os_type"], cloned["cloned_from"]), ("kali", snapshot["id"]))
+
+        # Once deleted, the snapshot can no longer be read or cloned
+        response = requests.delete(f"{self.base_url}/api/snapshots/{snapshot['id']}")
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(f"{self.base_url}/api/snapshots/{snapshot['id']}")
+        self.assertEqual(response.status_code, 404)
+        response = requests.post(
+            f"{self.base_url}/api/sandboxes",
+            json={"name": f"{self.test_sandbox_name}-clone", "os_type": "kali", "snapshot_id": snapshot["id"]}
+        )
+        self.assertEqual(response.status_code, 404)
+
+        for created in (sandbox_id, clone["sandbox_id"]):
+            requests.delete(f"{self.base_url}/api/sandboxes/{created}")
+        print("✅ Sandbox snapshots passed")
+
 if __name__ == "__main__":
     # Run the tests in order
     test_suite = unittest.TestSuite()
@@ -277,6 +517,13 @@ if __name__ == "__main__":
     test_suite.addTest(TrolixVEAPITester('test_10_get_terminal_history'))
     test_suite.addTest(TrolixVEAPITester('test_11_delete_sandbox'))
     test_suite.addTest(TrolixVEAPITester('test_12_error_handling'))
+    test_suite.addTest(TrolixVEAPITester('test_13_provisioning_job'))
+    test_suite.addTest(TrolixVEAPITester('test_14_bulk_create_sandboxes'))
+    test_suite.addTest(TrolixVEAPITester('test_15_sandboxes_pagination'))
+    test_suite.addTest(TrolixVEAPITester('test_16_terminal_history_pagination'))
+    test_suite.addTest(TrolixVEAPITester('test_17_bulk_sandbox_actions'))
+    test_suite.addTest(TrolixVEAPITester('test_18_warm_pool_hit'))
+    test_suite.addTest(TrolixVEAPITester('test_19_sandbox_snapshots'))
     
     runner = unittest.TextTestRunner(verbosity=2)
     result = runner.run(test_suite)
@@ -3,16 +3,22 @@ import './App.css';
 
 const App = () => {
   const [sandboxes, setSandboxes] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [summary, setSummary] = useState({ total: 0, by_status: {} });
   const [activeSandbox, setActiveSandbox] = useState(null);
   const [showCreateModal, setShowCreateModal] = useState(false);
   const [osTemplates, setOsTemplates] = useState({});
   const [terminalHistory, setTerminalHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
   const [currentCommand, setCurrentCommand] = useState('');
   const [isLoading, setIsLoading] = useState(true);
   const [showTerminal, setShowTerminal] = useState(false);
   const terminalRef = useRef(null);
+  const socketRef = useRef(null);
 
   const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+  const PAGE_SIZE = 50;
+  const HISTORY_PAGE_SIZE = 200;
 
   useEffect(() => {
     fetchOsTemplates();
@@ -64,9 +70,14 @@ const App = () => {
 
   const fetchSandboxes = async () => {
     try {
-      const response = await fetch(`${API_URL}/api/sandboxes`);
+      const [response, summaryResponse] = await Promise.all([
+        fetch(`${API_URL}/api/sandboxes?limit=${PAGE_SIZE}`),
+        fetch(`${API_URL}/api/sandboxes/summary`)
+      ]);
       const data = await response.json();
       setSandboxes(data);
+      setNextCursor(response.headers.get('X-Next-Cursor'));
+      setSummary(await summaryResponse.json());
       setIsLoading(false);
     } catch (error) {
       console.error('Error fetching sandboxes:', error);
@@ -74,6 +85,21 @@ const App = () => {
     }
   };
 
+  const fetchMoreSandboxes = async () => {
+    if (!nextCursor) return;
+    try {
+      const response = await fetch(`${API_URL}/api/sandboxes?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`);
+      const data = await response.json();
+      setSandboxes(prev => {
+        const known = new Set(prev.map(sandbox => sandbox.id));
+        return [...prev, ...data.filter(sandbox => !known.has(sandbox.id))];
+      });
+      setNextCursor(response.headers.get('X-Next-Cursor'));
+    } catch (error) {
+      console.error('Error fetching sandboxes:', error);
+    }
+  };
+
   const createSandbox = async (config) => {
     try {
       const response = await fetch(`${API_URL}/api/sandboxes`, {
@@ -83,7 +109,6 @@ const App = () => {
       });
       
       if (response.ok) {
-        fetchSandboxes();
         setShowCreateModal(false);
       }
     } catch (error) {
@@ -91,15 +116,49 @@ const App = () => {
     }
   };
 
+  const adjustSummary = (summary, status, delta) => ({
+    total: summary.total + delta,
+    by_status: { ...summary.by_status, [status]: (summary.by_status[status] || 0) + delta }
+  });
+
+  const handleSandboxEvent = (event) => {
+    if (event.type === 'sandbox.created') {
+      setSandboxes(prev => prev.some(sandbox => sandbox.id === event.sandbox_id) ? prev : [...prev, event.data]);
+      setSummary(prev => adjustSummary(prev, event.data.status, 1));
+    } else if (event.type === 'sandbox.updated') {
+      const { changes, previous_status: previousStatus } = event.data;
+      setSandboxes(prev => prev.map(sandbox => sandbox.id === event.sandbox_id ? { ...sandbox, ...changes } : sandbox));
+      if (changes.status && changes.status !== previousStatus) {
+        setSummary(prev => ({
+          total: prev.total,
+          by_status: {
+            ...prev.by_status,
+            [previousStatus]: (prev.by_status[previousStatus] || 0) - 1,
+            [changes.status]: (prev.by_status[changes.status] || 0) + 1
+          }
+        }));
+      }
+    } else if (event.type === 'sandbox.deleted') {
+      setSandboxes(prev => prev.filter(sandbox => sandbox.id !== event.sandbox_id));
+      setSummary(prev => adjustSummary(prev, event.data.previous_status, -1));
+    }
+  };
+
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/api/events`);
+    ['sandbox.created', 'sandbox.updated', 'sandbox.deleted'].forEach(type => {
+      source.addEventListener(type, (message) => handleSandboxEvent(JSON.parse(message.data)));
+    });
+    // The server could not replay what we missed, reload the list
+    source.addEventListener('reset', () => fetchSandboxes());
+    return () => source.close();
+  }, []);
+
   const controlSandbox = async (sandboxId, action) => {
     try {
-      const response = await fetch(`${API_URL}/api/sandboxes/${sandboxId}/${action}`, {
+      await fetch(`${API_URL}/api/sandboxes/${sandboxId}/${action}`, {
         method: 'POST'
       });
-      
-      if (response.ok) {
-        fetchSandboxes();
-      }
     } catch (error) {
       console.error(`Error ${action} sandbox:`, error);
     }
@@ -113,7 +172,6 @@ const App = () => {
         });
         
         if (response.ok) {
-          fetchSandboxes();
           if (activeSandbox?.id === sandboxId) {
             setActiveSandbox(null);
             setShowTerminal(false);
@@ -129,18 +187,83 @@ const App = () => {
     setActiveSandbox(sandbox);
     setShowTerminal(true);
     
-    // Fetch terminal history
+    // Fetch the most recent terminal history
     try {
-      const response = await fetch(`${API_URL}/api/terminal/${sandbox.id}/history`);
+      const response = await fetch(`${API_URL}/api/terminal/${sandbox.id}/history?tail=${HISTORY_PAGE_SIZE}`);
       const history = await response.json();
       setTerminalHistory(history);
+      setHistoryCursor(response.headers.get('X-Has-More') === 'true' ? response.headers.get('X-Prev-Cursor') : null);
     } catch (error) {
       console.error('Error fetching terminal history:', error);
     }
   };
 
+  const fetchOlderHistory = async () => {
+    if (!activeSandbox || !historyCursor) return;
+    try {
+      const response = await fetch(`${API_URL}/api/terminal/${activeSandbox.id}/history?limit=${HISTORY_PAGE_SIZE}&before=${encodeURIComponent(historyCursor)}`);
+      const history = await response.json();
+      setTerminalHistory(prev => [...history, ...prev]);
+      setHistoryCursor(response.headers.get('X-Has-More') === 'true' ? response.headers.get('X-Prev-Cursor') : null);
+    } catch (error) {
+      console.error('Error fetching terminal history:', error);
+    }
+  };
+
+  const handleTerminalMessage = (message) => {
+    if (message.type === 'output') {
+      setTerminalHistory(prev => {
+        const last = prev[prev.length - 1];
+        if (last && last.streaming && last.timestamp === message.timestamp) {
+          return [...prev.slice(0, -1), { ...last, output: `${last.output}\n${message.data}` }];
+        }
+        return [...prev, {
+          command: message.command,
+          output: message.data,
+          timestamp: message.timestamp,
+          streaming: true
+        }];
+      });
+    } else if (message.type === 'result') {
+      setTerminalHistory(prev => {
+        if (message.streamed) {
+          return prev.map(entry => entry.streaming && entry.timestamp === message.timestamp
+            ? { ...entry, streaming: false }
+            : entry);
+        }
+        return [...prev, {
+          command: message.command,
+          output: message.output,
+          timestamp: message.timestamp
+        }];
+      });
+    } else if (message.type === 'error') {
+      console.error('Terminal error:', message.detail);
+    }
+  };
+
+  useEffect(() => {
+    if (!showTerminal || !activeSandbox) return;
+
+    const socket = new WebSocket(`${API_URL.replace(/^http/, 'ws')}/api/terminal/${activeSandbox.id}/ws`);
+    socket.onmessage = (event) => handleTerminalMessage(JSON.parse(event.data));
+    socketRef.current = socket;
+
+    return () => {
+      socket.close();
+      socketRef.current = null;
+    };
+  }, [showTerminal, activeSandbox]);
+
   const executeCommand = async (command) => {
     if (!activeSandbox || !command.trim()) return;
+
+    // Prefer the websocket channel, fall back to HTTP while it is not open
+    if (socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
+      socketRef.current.send(JSON.stringify({ command }));
+      setCurrentCommand('');
+      return;
+    }
     
     try {
       const response = await fetch(`${API_URL}/api/terminal/execute`, {
@@ -320,11 +443,11 @@ const App = () => {
           <div className="header-stats">
             <div className="stat">
               <span className="stat-label">Sandboxes Actives</span>
-              <span className="stat-value">{sandboxes.filter(s => s.status === 'running').length}</span>
+              <span className="stat-value">{summary.by_status.running || 0}</span>
             </div>
             <div className="stat">
               <span className="stat-label">Total</span>
-              <span className="stat-value">{sandboxes.length}</span>
+              <span className="stat-value">{summary.total}</span>
             </div>
           </div>
         </div>
@@ -416,6 +539,14 @@ const App = () => {
           ))}
         </div>
 
+        {nextCursor && (
+          <div className="toolbar">
+            <button className="btn-secondary" onClick={fetchMoreSandboxes}>
+              ⬇️ Charger plus
+            </button>
+          </div>
+        )}
+
         {sandboxes.length === 0 && (
           <div className="empty-state">
             <div className="empty-icon">🚀</div>
@@ -446,6 +577,12 @@ const App = () => {
                 <br />Tapez 'help' pour voir les commandes disponibles
                 <br />
               </div>
+
+              {historyCursor && (
+                <button className="btn-secondary" onClick={fetchOlderHistory}>
+                  ⬆️ Historique précédent
+                </button>
+              )}
               
               {terminalHistory.map((entry, index) => (
                 <div key={index} className="terminal-entry">
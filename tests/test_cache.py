@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from mongomock_motor import AsyncMongoMockClient
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from cache import TTLCache
+from repository import SandboxRepository
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.peek("b"))
+        self.assertEqual((cache.peek("a"), cache.peek("c")), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache(ttl=10)
+        with mock.patch("cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with mock.patch("cache.time.monotonic", return_value=109.0):
+            self.assertEqual(cache.get("a"), 1)
+        with mock.patch("cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.peek("a"))
+            self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["expirations"]), (0, 1))
+
+    def test_counters(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("missing")
+        # peek touches neither the counters nor recency
+        cache.peek("a")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (2, 1, 0.6667))
+
+    def test_zero_maxsize_disables_the_cache(self):
+        cache = TTLCache(maxsize=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+class SandboxRepositoryCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache = TTLCache()
+        self.repository = SandboxRepository(AsyncMongoMockClient().test_db.sandboxes, cache=self.cache)
+        await self.repository.insert_many([
+            {"id": "a", "status": "running"},
+            {"id": "b", "status": "running"},
+        ])
+
+    async def test_update_patches_the_cached_record(self):
+        self.assertTrue(await self.repository.update("a", {"status": "stopped"}))
+        self.assertEqual(self.cache.peek("a")["status"], "stopped")
+        # Served from the cache without touching the collection
+        with mock.patch.object(self.repository.collection, "find_one", side_effect=AssertionError):
+            self.assertEqual((await self.repository.get("a"))["status"], "stopped")
+
+    async def test_update_that_matches_nothing_invalidates(self):
+        self.assertFalse(await self.repository.update("a", {"status": "stopped"}, expected_status="creating"))
+        self.assertIsNone(self.cache.peek("a"))
+        self.assertEqual((await self.repository.get("a"))["status"], "running")
+
+    async def test_update_many_patches_every_cached_record(self):
+        await self.repository.update_many({"a": "running", "b": "running"}, {"status": "saved"})
+        self.assertEqual({self.cache.peek(key)["status"] for key in ("a", "b")}, {"saved"})
+
+    async def test_delete_invalidates(self):
+        self.assertTrue(await self.repository.delete("a"))
+        self.assertIsNone(self.cache.peek("a"))
+        self.assertIsNone(await self.repository.get("a"))
+
+    async def test_cached_records_are_copies(self):
+        (await self.repository.get("a"))["status"] = "changed"
+        self.assertEqual((await self.repository.get("a"))["status"], "running")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from events import EventBus
+
+
+class EventBusTest(unittest.IsolatedAsyncioTestCase):
+    def publish(self, bus, count):
+        for index in range(count):
+            bus.publish("sandbox.updated", f"sandbox-{index}")
+
+    async def test_resume_replays_missed_events(self):
+        bus = EventBus(buffer_size=10)
+        self.publish(bus, 5)
+        subscription, reset = bus.subscribe(bus.parse_event_id(bus.event_id(3)))
+        self.assertFalse(reset)
+        self.assertEqual([subscription.queue.get_nowait()["seq"] for _ in range(2)], [4, 5])
+
+    async def test_resume_from_before_the_buffer_resets(self):
+        bus = EventBus(buffer_size=2)
+        self.publish(bus, 5)
+        _, reset = bus.subscribe(1)
+        self.assertTrue(reset)
+
+    async def test_resume_after_a_restart_resets(self):
+        previous = EventBus()
+        self.publish(previous, 8)
+        last_event_id = previous.event_id(previous.seq)
+
+        restarted = EventBus()
+        self.publish(restarted, 2)
+        since = restarted.parse_event_id(last_event_id)
+        self.assertEqual(since, -1)
+        subscription, reset = restarted.subscribe(since)
+        self.assertTrue(reset)
+        self.assertTrue(subscription.queue.empty())
+
+        # Even with the bare sequence number, one ahead of the feed resets
+        self.assertTrue(restarted.subscribe(8)[1])
+        self.assertEqual(restarted.parse_event_id("8"), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
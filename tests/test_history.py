@@ -0,0 +1,29 @@
+import unittest
+from datetime import datetime, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from commands import COMMAND_RESPONSES, TOOL_RESPONSES
+from repository import SessionRepository
+
+
+class SessionDeduplicationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_canned_outputs_are_stored_once(self):
+        db = AsyncMongoMockClient().test_db
+        sessions = SessionRepository(db.sessions, outputs=db.outputs, dedup_min_bytes=64)
+        entries = [
+            {"sandbox_id": f"sandbox-{index % 3}", "command": command, "output": output, "timestamp": datetime.now(timezone.utc)}
+            for index in range(9)
+            for command, output in (("nmap", TOOL_RESPONSES["nmap"]), ("whoami", COMMAND_RESPONSES["whoami"]))
+        ]
+        await sessions.add_many(entries)
+
+        self.assertEqual(await db.outputs.count_documents({}), 1)
+        self.assertEqual(await db.sessions.count_documents({"output_ref": {"$exists": True}}), 9)
+        history, _ = await sessions.page("sandbox-0")
+        self.assertEqual([entry["output"] for entry in history[:2]], [TOOL_RESPONSES["nmap"], "root"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from history_writer import HistoryWriter
+
+
+def entry(sandbox_id="a"):
+    return {"sandbox_id": sandbox_id, "command": "pwd"}
+
+
+class FakeSessions:
+    """Records the batches written; `release` holds writes until it is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def insert_many(self, batch):
+        await self.release.wait()
+        self.batches.append(list(batch))
+
+
+class HistoryWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sessions = FakeSessions()
+
+    async def start(self, **options):
+        writer = HistoryWriter(self.sessions.insert_many, **options)
+        writer.start()
+        self.addAsyncCleanup(writer.stop)
+        return writer
+
+    async def settle(self):
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def test_full_batch_is_written_without_waiting_for_the_interval(self):
+        writer = await self.start(batch_size=3, flush_interval=60)
+        for _ in range(3):
+            await writer.add(entry())
+        await self.settle()
+        self.assertEqual([len(batch) for batch in self.sessions.batches], [3])
+        self.assertEqual(writer.stats()["queued"], 0)
+
+    async def test_partial_batch_is_written_after_the_interval(self):
+        writer = await self.start(batch_size=100, flush_interval=0.05)
+        await writer.add(entry("a"))
+        await writer.add(entry("b"))
+        await self.settle()
+        self.assertEqual(self.sessions.batches, [])
+        self.assertTrue(writer.has_pending("a"))
+
+        await asyncio.sleep(0.1)
+        self.assertEqual([len(batch) for batch in self.sessions.batches], [2])
+        self.assertFalse(writer.has_pending("a"))
+        self.assertEqual(writer.stats()["written"], 2)
+
+    async def test_add_blocks_when_max_pending_entries_wait(self):
+        self.sessions.release.clear()
+        writer = await self.start(batch_size=1, flush_interval=0, max_pending=2)
+        # One entry is held in the stalled write, two more fill the queue
+        for _ in range(3):
+            await writer.add(entry())
+            await self.settle()
+        blocked = asyncio.create_task(writer.add(entry()))
+        await self.settle()
+        self.assertFalse(blocked.done())
+
+        self.sessions.release.set()
+        await asyncio.wait_for(blocked, 1)
+        await writer.flush()
+        self.assertEqual(len(self.sessions.batches), 4)
+
+    async def test_failed_write_is_counted_and_clears_pending(self):
+        async def insert_many(batch):
+            raise RuntimeError("database down")
+
+        writer = HistoryWriter(insert_many, batch_size=1)
+        writer.start()
+        with self.assertLogs("trolixve.history", "ERROR"):
+            await writer.add(entry())
+            await writer.stop()
+        self.assertEqual(writer.stats()["failed"], 1)
+        self.assertFalse(writer.has_pending("a"))
+
+    async def test_stop_writes_buffered_entries(self):
+        writer = HistoryWriter(self.sessions.insert_many, batch_size=100, flush_interval=60)
+        writer.start()
+        await writer.add(entry())
+        await self.settle()
+        # An entry arriving as the writer is cancelled must not keep it running
+        await writer.add(entry())
+        await asyncio.wait_for(writer.stop(), 1)
+        self.assertEqual([len(batch) for batch in self.sessions.batches], [2])
+        self.assertFalse(writer.has_pending("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from tests.support import load_server, wait_for_status
+from provisioning import ProvisioningQueue
+from scheduler import ResourceScheduler
+
+
+class ProvisioningQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_jobs_waiting_for_room_do_not_hold_workers(self):
+        scheduler = ResourceScheduler({"cpu_cores": 8, "ram_gb": 64, "disk_gb": 1000})
+        self.assertTrue(scheduler.try_claim("busy", {"cpu_cores": 4, "ram_gb": 4, "disk_gb": 10}))
+        requests = {f"big-{n}": {"cpu_cores": 5, "ram_gb": 4, "disk_gb": 10} for n in range(4)}
+        requests["small"] = {"cpu_cores": 1, "ram_gb": 1, "disk_gb": 10}
+        provisioned = []
+
+        async def provision(sandbox_id):
+            provisioned.append(sandbox_id)
+
+        async def admit(sandbox_id):
+            return await scheduler.admit(sandbox_id, requests[sandbox_id])
+
+        queue = ProvisioningQueue(provision, workers=4, admit=admit)
+        queue.start()
+        try:
+            jobs = [queue.submit(sandbox_id) for sandbox_id in requests]
+            while jobs[-1]["status"] != "completed":
+                await asyncio.sleep(0.01)
+            self.assertEqual(provisioned, ["small"])
+            self.assertEqual([job["status"] for job in jobs[:4]], ["waiting"] * 4)
+            self.assertEqual(queue.stats()["pending"], 4)
+
+            # Freeing the busy sandbox makes room for one of the big ones
+            scheduler.release("busy")
+            while len(provisioned) < 2:
+                await asyncio.sleep(0.01)
+            self.assertEqual(provisioned[1], "big-0")
+        finally:
+            await queue.stop()
+
+
+class ProvisioningRestartTest(unittest.TestCase):
+    def test_sandbox_left_creating_is_requeued_at_startup(self):
+        server = load_server()
+        config = server.SandboxConfig(name="left-creating", os_type="kali", cpu_cores=1)
+        document = server.new_sandbox_document(config)
+
+        # A previous process inserted the sandbox and died before provisioning it
+        with TestClient(server.app) as client:
+            client.portal.call(server.sandboxes.insert, document)
+
+        with TestClient(server.app) as client:
+            self.assertEqual(wait_for_status(client, document["id"], "running"), "running")
+            client.delete(f"/api/sandboxes/{document['id']}")
+
+
+class ProvisioningFailureTest(unittest.TestCase):
+    def test_failed_job_fails_the_sandbox_and_releases_it(self):
+        server = load_server()
+        config = server.SandboxConfig(name="broken-clone", os_type="kali", cpu_cores=1)
+        document = {**server.new_sandbox_document(config), "cloned_from": "snapshot-1", "pool": True}
+
+        with TestClient(server.app) as client:
+            client.portal.call(server.sandboxes.insert, document)
+            with mock.patch.object(server.snapshot_records, "get", side_effect=RuntimeError("snapshot store down")):
+                job = client.portal.call(server.provisioning_queue.submit, document["id"])
+                deadline = time.monotonic() + 5
+                while job["status"] not in ("completed", "failed") and time.monotonic() < deadline:
+                    time.sleep(0.02)
+
+            self.assertEqual(job["status"], "failed")
+            self.assertEqual(job["error"], "snapshot store down")
+            self.assertEqual(client.portal.call(server.sandboxes.get, document["id"])["status"], "error")
+            self.assertNotIn(document["id"], server.scheduler.allocations)
+            self.assertEqual(client.portal.call(server.sandboxes.pooled_counts).get("kali", 0), 0)
+            client.delete(f"/api/sandboxes/{document['id']}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from tests.support import load_server
+from ratelimit import Limit, RateLimited, RateLimiter, TokenBuckets
+
+
+class SlowBuckets(TokenBuckets):
+    """Buckets that take a while to answer, like a shared backend."""
+
+    async def take(self, key, rate, burst, cost=1):
+        await asyncio.sleep(0.01)
+        return await super().take(key, rate, burst, cost)
+
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_rate_refusal_reports_retry_after(self):
+        limit = Limit("terminal", rate=2, burst=2)
+        limiter = RateLimiter(TokenBuckets(), [])
+        await limiter.acquire(limit, "client")
+        await limiter.acquire(limit, "client")
+        with self.assertRaises(RateLimited) as refused:
+            await limiter.acquire(limit, "client")
+        self.assertEqual(refused.exception.reason, "rate")
+        self.assertGreater(refused.exception.retry_after, 0.4)
+        self.assertEqual(refused.exception.retry_after_header, "1")
+        # Other clients have their own bucket
+        await limiter.acquire(limit, "other")
+
+    async def test_concurrency_cap_holds_while_buckets_are_awaited(self):
+        limit = Limit("terminal", rate=100, burst=100, client_concurrency=2)
+        limiter = RateLimiter(SlowBuckets(), [])
+        results = await asyncio.gather(
+            *(limiter.acquire(limit, "client") for _ in range(5)), return_exceptions=True
+        )
+        admitted = [result for result in results if not isinstance(result, RateLimited)]
+        self.assertEqual(len(admitted), 2)
+        self.assertEqual(limiter.limited["terminal", "concurrency"], 3)
+
+        for held in admitted:
+            limiter.release(held)
+        self.assertEqual(limiter.in_flight, {})
+        await limiter.acquire(limit, "client")
+
+    async def test_refused_request_gives_its_slots_back(self):
+        limit = Limit("terminal", rate=1, burst=1, client_concurrency=5, sandbox_concurrency=1)
+        limiter = RateLimiter(TokenBuckets(), [])
+        limiter.release(await limiter.acquire(limit, "client", "sandbox"))
+        with self.assertRaises(RateLimited):
+            await limiter.acquire(limit, "client", "sandbox")
+        self.assertEqual(limiter.in_flight, {})
+
+    async def test_sandbox_cap_applies_across_clients(self):
+        limit = Limit("terminal", rate=0, burst=1, sandbox_concurrency=1)
+        limiter = RateLimiter(TokenBuckets(), [])
+        await limiter.acquire(limit, "one", "sandbox")
+        with self.assertRaises(RateLimited):
+            await limiter.acquire(limit, "two", "sandbox")
+        await limiter.acquire(limit, "two", "another")
+
+    def test_client_of_forwarded_requests(self):
+        request = SimpleNamespace(
+            headers={"x-forwarded-for": "203.0.113.7, 10.0.0.2"}, client=SimpleNamespace(host="10.0.0.1")
+        )
+        self.assertEqual(RateLimiter(TokenBuckets(), [], trust_proxy=True).client_of(request), "203.0.113.7")
+
+        limiter = RateLimiter(TokenBuckets(), [])
+        with self.assertLogs("trolixve.ratelimit", "WARNING") as logs:
+            self.assertEqual(limiter.client_of(request), "10.0.0.1")
+            limiter.client_of(request)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_match_extracts_the_sandbox_id(self):
+        limit = Limit("provisioning", rate=1, burst=1)
+        limiter = RateLimiter(TokenBuckets(), [("POST", r"/api/sandboxes/(?P<sandbox_id>[^/]+)/start", limit)])
+        self.assertEqual(limiter.match("POST", "/api/sandboxes/abc/start"), (limit, "abc"))
+        self.assertEqual(limiter.match("GET", "/api/sandboxes/abc/start"), (None, None))
+
+
+class RateLimitMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.server = load_server()
+        self.limit = self.server.provisioning_limit
+        self.saved = (self.limit.rate, self.limit.burst)
+        self.limit.rate, self.limit.burst = 0.5, 1
+
+    def tearDown(self):
+        self.limit.rate, self.limit.burst = self.saved
+
+    def test_429_with_retry_after(self):
+        with TestClient(self.server.app, headers={"Origin": "http://dashboard"}) as client:
+            # An unknown sandbox still spends a token
+            self.assertEqual(client.post("/api/sandboxes/missing-id/stop").status_code, 404)
+            response = client.post("/api/sandboxes/missing-id/stop")
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers["Retry-After"], "2")
+            self.assertIn("access-control-allow-origin", response.headers)
+
+            # Routes without a limit are not affected
+            self.assertEqual(client.get("/api/health").status_code, 200)
+            stats = client.get("/api/health/rate-limits").json()
+            self.assertGreaterEqual(stats["limits"]["provisioning"]["limited"]["rate"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from reaper import IdleReaper
+from repository import SandboxRepository, as_utc
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def sandbox(sandbox_id, status="running", **fields):
+    return {"id": sandbox_id, "status": status, "uptime": 0, "last_accessed": START, "uptime_updated_at": START, **fields}
+
+
+class UptimeAccountingTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repository = SandboxRepository(AsyncMongoMockClient().test_db.sandboxes)
+
+    async def stored(self, sandbox_id):
+        doc = await self.repository.collection.find_one({"id": sandbox_id})
+        return doc["uptime"], as_utc(doc["uptime_updated_at"])
+
+    async def test_whole_seconds_accumulate_and_the_fraction_carries_over(self):
+        await self.repository.insert_many([sandbox("a"), sandbox("b", status="stopped")])
+
+        await self.repository.account_uptime(["a", "b"], START + timedelta(seconds=10.7))
+        self.assertEqual(await self.stored("a"), (10, START + timedelta(seconds=10)))
+        self.assertEqual(await self.stored("b"), (0, START))
+
+        # The 0.7s left over counts towards the next pass
+        await self.repository.account_uptime(["a"], START + timedelta(seconds=11.4))
+        self.assertEqual(await self.stored("a"), (11, START + timedelta(seconds=11)))
+
+        # Accounting the same moment twice adds nothing
+        await self.repository.account_uptime(["a"], START + timedelta(seconds=11.4))
+        self.assertEqual(await self.stored("a"), (11, START + timedelta(seconds=11)))
+
+    async def test_uptime_starts_from_last_access_when_never_accounted(self):
+        await self.repository.insert(sandbox("a", uptime_updated_at=None))
+        await self.repository.account_uptime(["a"], START + timedelta(seconds=5))
+        self.assertEqual(await self.stored("a"), (5, START + timedelta(seconds=5)))
+
+    async def test_touch_many_only_moves_last_access_forward(self):
+        await self.repository.insert_many([sandbox("a"), sandbox("b")])
+        earlier, later = START - timedelta(minutes=1), START + timedelta(minutes=1)
+        await self.repository.touch_many({"a": later, "b": earlier})
+        self.assertEqual(as_utc((await self.repository.collection.find_one({"id": "a"}))["last_accessed"]), later)
+        self.assertEqual(as_utc((await self.repository.collection.find_one({"id": "b"}))["last_accessed"]), START)
+
+
+class IdleReaperTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repository = SandboxRepository(AsyncMongoMockClient().test_db.sandboxes)
+        self.saved = []
+
+    async def on_save(self, sandbox_ids):
+        self.saved.extend(sandbox_ids)
+
+    async def sweep(self, action):
+        now = datetime.now(timezone.utc)
+        await self.repository.insert_many([
+            sandbox("idle", last_accessed=now - timedelta(hours=2), uptime_updated_at=now - timedelta(hours=2)),
+            sandbox("active", last_accessed=now - timedelta(hours=2), uptime_updated_at=now - timedelta(hours=2)),
+            sandbox("stopped", status="stopped", last_accessed=now - timedelta(hours=2)),
+        ])
+        reaper = IdleReaper(self.repository, idle_after=1800, action=action, batch_size=1, on_save=self.on_save)
+        reaper.start()
+        try:
+            # Terminal activity recorded in memory keeps a sandbox alive
+            reaper.touch("active")
+            await reaper.sweep()
+        finally:
+            await reaper.stop()
+        statuses = {doc["id"]: doc["status"] async for doc in self.repository.collection.find()}
+        return reaper, statuses
+
+    async def test_idle_sandboxes_are_saved(self):
+        reaper, statuses = await self.sweep("save")
+        self.assertEqual(statuses, {"idle": "saved", "active": "running", "stopped": "stopped"})
+        self.assertEqual(self.saved, ["idle"])
+        self.assertEqual(reaper.stats()["reaped"], 1)
+        # Uptime was brought up to date before the sandbox was saved
+        self.assertGreaterEqual((await self.repository.collection.find_one({"id": "idle"}))["uptime"], 7200)
+
+    async def test_idle_sandboxes_are_stopped(self):
+        _, statuses = await self.sweep("stop")
+        self.assertEqual(statuses, {"idle": "stopped", "active": "running", "stopped": "stopped"})
+        self.assertEqual(self.saved, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import unittest
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from scheduler import CapacityError, ResourceScheduler
+
+
+def request(cpu, ram, disk=1):
+    return {"cpu_cores": cpu, "ram_gb": ram, "disk_gb": disk}
+
+
+class ResourceSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.scheduler = ResourceScheduler({"cpu_cores": 4, "ram_gb": 8, "disk_gb": 100})
+
+    def test_check_rejects_requests_larger_than_the_host(self):
+        with self.assertRaises(CapacityError):
+            self.scheduler.check(request(8, 1))
+        self.scheduler.check(request(4, 8))
+
+    def test_try_claim_refuses_what_does_not_fit(self):
+        self.assertTrue(self.scheduler.try_claim("a", request(3, 6)))
+        self.assertFalse(self.scheduler.try_claim("b", request(2, 1)))
+        self.assertEqual(self.scheduler.stats()["refused"], 1)
+        # Claiming again for a running sandbox costs nothing
+        self.assertTrue(self.scheduler.try_claim("a", request(3, 6)))
+        self.assertEqual(self.scheduler.allocated["cpu_cores"], 3)
+
+    async def test_admit_waits_until_capacity_is_released(self):
+        self.assertTrue(await self.scheduler.admit("a", request(4, 4)))
+        waiting = asyncio.create_task(self.scheduler.admit("b", request(2, 2)))
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+
+        self.scheduler.observe({"type": "sandbox.updated", "sandbox_id": "a", "data": {"changes": {"status": "stopped"}}})
+        self.assertTrue(await waiting)
+        self.assertEqual(self.scheduler.allocated["cpu_cores"], 2)
+        # The stopped sandbox keeps its disk
+        self.assertEqual(self.scheduler.allocated["disk_gb"], 2)
+
+    async def test_admit_lets_a_fitting_request_pass_a_larger_waiter(self):
+        self.assertTrue(await self.scheduler.admit("a", request(2, 6)))
+        large = asyncio.create_task(self.scheduler.admit("large", request(3, 4)))
+        await asyncio.sleep(0)
+        small = await asyncio.wait_for(self.scheduler.admit("small", request(1, 1)), 1)
+        self.assertTrue(small)
+        self.assertFalse(large.done())
+
+        self.scheduler.release("a")
+        self.assertTrue(await asyncio.wait_for(large, 1))
+
+    async def test_release_of_a_waiting_sandbox_cancels_its_admission(self):
+        await self.scheduler.admit("a", request(4, 8))
+        waiting = asyncio.create_task(self.scheduler.admit("b", request(1, 1)))
+        await asyncio.sleep(0)
+        self.scheduler.release("b")
+        self.assertFalse(await waiting)
+        self.assertEqual(self.scheduler.stats()["waiting"], 0)
+
+    def test_release_returns_everything_and_load_rebuilds(self):
+        self.scheduler.try_claim("a", request(2, 2, 10))
+        self.scheduler.release("a")
+        self.assertEqual(self.scheduler.allocated, {"cpu_cores": 0, "ram_gb": 0, "disk_gb": 0})
+
+        self.scheduler.load([
+            {"id": "a", "status": "running", **request(2, 2, 10)},
+            {"id": "b", "status": "stopped", **request(1, 1, 5)},
+            {"id": "c", "status": "error", **request(1, 1, 5)},
+        ])
+        self.assertEqual(self.scheduler.allocated, {"cpu_cores": 2, "ram_gb": 2, "disk_gb": 15})
+
+
+if __name__ == "__main__":
+    unittest.main()
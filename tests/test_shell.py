@@ -0,0 +1,121 @@
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from tests.support import BACKEND_DIR  # noqa: F401  (puts backend/ on sys.path)
+from commands import create_dispatcher
+from repository import ShellRepository
+from shell import BASE_IMAGES, ShellEngine
+
+TEMPLATES = {os_type: {"name": os_type} for os_type in BASE_IMAGES}
+
+
+class ShellEngineTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        db = AsyncMongoMockClient().test_db
+        self.repository = ShellRepository(db.shells, db.shell_files)
+        self.dispatcher = create_dispatcher(TEMPLATES)
+        self.engine = ShellEngine(self.repository, self.dispatcher)
+        self.sandbox = {"id": "sandbox-1", "os_type": "kali", "disk_gb": 20}
+
+    async def run_commands(self, *commands, engine=None):
+        engine = engine or self.engine
+        return [await engine.execute(self.sandbox, command) for command in commands]
+
+    async def test_cd_and_relative_paths(self):
+        outputs = await self.run_commands("pwd", "mkdir -p /tmp/work/src", "cd /tmp/work", "cd src", "pwd", "cd ..", "ls")
+        self.assertEqual(outputs[0], "/root")
+        self.assertEqual(outputs[4], "/tmp/work/src")
+        self.assertEqual(outputs[6], "src")
+        self.assertEqual(await self.engine.execute(self.sandbox, "cd missing"), "cd: missing: No such file or directory")
+
+    async def test_redirects_and_variable_expansion(self):
+        outputs = await self.run_commands(
+            "export GREETING=hello",
+            "echo $GREETING > /tmp/out.txt",
+            "echo ${GREETING} again >> /tmp/out.txt",
+            "cat /tmp/out.txt",
+            "echo '$GREETING'",
+            "unset GREETING",
+            "echo [$GREETING]",
+        )
+        self.assertEqual(outputs[1], "")
+        self.assertEqual(outputs[3], "hello\nhello again")
+        self.assertEqual(outputs[4], "$GREETING")
+        self.assertEqual(outputs[6], "[]")
+
+    async def test_redirect_inside_a_word(self):
+        outputs = await self.run_commands(
+            "echo one>/tmp/inline",
+            "echo two>>/tmp/inline",
+            "echo 'a>b' \"c >> d\"",
+            "cat /tmp/inline",
+        )
+        self.assertEqual(outputs[0], "")
+        self.assertEqual(outputs[2], "a>b c >> d")
+        self.assertEqual(outputs[3], "one\ntwo")
+
+    async def test_image_is_shared_until_written(self):
+        other = {**self.sandbox, "id": "sandbox-2"}
+        await self.engine.execute(self.sandbox, "touch /etc/marker")
+        first = await self.engine.state(self.sandbox)
+        second = await self.engine.state(other)
+        self.assertIsNot(first.root, second.root)
+        self.assertIs(first.root["usr"], second.root["usr"])
+        self.assertIsNone(second.node("/etc/marker"))
+        self.assertIsNone(BASE_IMAGES["kali"].root["etc"].get("marker"))
+
+    async def test_rm_recursive_then_recreate(self):
+        await self.run_commands(
+            "mkdir -p /opt/tool/bin",
+            "echo old > /opt/tool/bin/run",
+            "rm -r /opt/tool",
+            "mkdir /opt/tool",
+            "echo new > /opt/tool/readme",
+            "rm /etc/hostname",
+        )
+        self.assertEqual(await self.engine.execute(self.sandbox, "ls /opt/tool"), "readme")
+
+        self.engine.states.clear()
+        outputs = await self.run_commands("ls /opt/tool", "cat /opt/tool/readme", "cat /etc/hostname")
+        self.assertEqual(outputs[0], "readme")
+        self.assertEqual(outputs[1], "new")
+        self.assertEqual(outputs[2], "cat: /etc/hostname: No such file or directory")
+
+    async def test_state_survives_eviction_and_reload(self):
+        engine = ShellEngine(self.repository, self.dispatcher, cache_size=1)
+        await self.run_commands("mkdir /srv/data", "cd /srv/data", "export MODE=lab", "echo 42 > answer", engine=engine)
+        # Loading another sandbox evicts this one from the one-entry cache
+        await engine.execute({**self.sandbox, "id": "sandbox-2"}, "pwd")
+        self.assertIsNone(engine.states.peek(self.sandbox["id"]))
+
+        stored, files = await self.repository.load(self.sandbox["id"])
+        self.assertEqual(stored["cwd"], "/srv/data")
+        self.assertEqual(stored["env"], {"MODE": "lab"})
+        self.assertEqual({change["path"] for change in files}, {"/srv/data", "/srv/data/answer"})
+
+        # A fresh engine, as after a restart, sees the same shell
+        restarted = ShellEngine(self.repository, self.dispatcher)
+        outputs = await self.run_commands("pwd", "echo $MODE", "cat answer", engine=restarted)
+        self.assertEqual(outputs, ["/srv/data", "lab", "42"])
+
+    async def test_capture_and_restore(self):
+        await self.run_commands("export MODE=lab", "echo 1 > /root/notes")
+        environment = await self.engine.capture_environment(self.sandbox)
+        files = await self.engine.capture_files(self.sandbox)
+        await self.run_commands("unset MODE", "rm /root/notes", "cd /tmp")
+
+        await self.engine.restore_environment(self.sandbox["id"], environment)
+        await self.engine.restore_files(self.sandbox["id"], files)
+        outputs = await self.run_commands("pwd", "echo $MODE", "cat /root/notes")
+        self.assertEqual(outputs, ["/root", "lab", "1"])
+
+    async def test_delete_for_drops_state(self):
+        await self.run_commands("echo 1 > /root/notes")
+        await self.engine.delete_for([self.sandbox["id"]])
+        self.assertEqual(await self.repository.load(self.sandbox["id"]), (None, []))
+        self.assertEqual(await self.engine.execute(self.sandbox, "cat /root/notes"), "cat: /root/notes: No such file or directory")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from fastapi.testclient import TestClient
+
+from tests.support import load_server
+
+
+class TerminalWebsocketTest(unittest.TestCase):
+    def setUp(self):
+        self.server = load_server()
+
+    def test_commands_over_the_websocket(self):
+        with TestClient(self.server.app) as client:
+            sandbox_id = client.post("/api/sandboxes", json={"name": "ws", "os_type": "kali", "cpu_cores": 1}).json()["sandbox_id"]
+            with client.websocket_connect(f"/api/terminal/{sandbox_id}/ws") as websocket:
+                websocket.send_json({"command": 5})
+                self.assertEqual(websocket.receive_json(), {"type": "error", "detail": "command must be a string"})
+
+                websocket.send_json({"command": "pwd"})
+                result = websocket.receive_json()
+                self.assertEqual((result["type"], result["output"]), ("result", "/root"))
+
+                # Plain text works too, and long outputs are streamed line by line
+                websocket.send_text("msfconsole")
+                lines = [websocket.receive_json() for _ in range(4)]
+                self.assertEqual({line["type"] for line in lines}, {"output"})
+                self.assertTrue(websocket.receive_json()["streamed"])
+            client.delete(f"/api/sandboxes/{sandbox_id}")
+
+    def test_deleting_a_sandbox_deletes_its_history(self):
+        with TestClient(self.server.app) as client:
+            sandbox_id = client.post("/api/sandboxes", json={"name": "ws", "os_type": "kali", "cpu_cores": 1}).json()["sandbox_id"]
+            with client.websocket_connect(f"/api/terminal/{sandbox_id}/ws") as websocket:
+                websocket.send_json({"command": "whoami"})
+                websocket.receive_json()
+                client.portal.call(self.server.history_writer.flush)
+                # This entry is still buffered by the history writer
+                websocket.send_json({"command": "pwd"})
+                websocket.receive_json()
+            self.assertEqual(client.delete(f"/api/sandboxes/{sandbox_id}").status_code, 200)
+            client.portal.call(self.server.history_writer.flush)
+            count = client.portal.call(self.server.sessions.collection.count_documents, {"sandbox_id": sandbox_id})
+            self.assertEqual(count, 0)
+
+    def test_unknown_sandbox_is_refused(self):
+        with TestClient(self.server.app) as client:
+            with client.websocket_connect("/api/terminal/missing-id/ws") as websocket:
+                self.assertEqual(websocket.receive_json()["type"], "error")
+
+
+if __name__ == "__main__":
+    unittest.main()